@@ -0,0 +1,132 @@
+# format_report.py
+# Compares the per-chart JSON files with the binary snapshot: size on disk, loading every chart, reading a single chart and saving.
+# Usage: python bench/format_report.py [--input data/leaderboard.json] [--synthetic-charts 1250] [--repeat 3] [--output report.json]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from leaderboard_store import LeaderboardStore
+from memory_report import make_synthetic_leaderboards, read_leaderboards
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'leaderboard.json')
+
+FORMATS = ['json', 'snapshot']
+
+def write_store(store_dir: str, leaderboards: dict, fmt: str):
+    """Write chart leaderboards to a store in one of the formats.
+    @param store_dir: the store directory
+    @param leaderboards: dict of { chart_id : dict of { player_id : score dict } }
+    @param fmt: the format, one of FORMATS
+    @return: None
+    """
+    store = LeaderboardStore(store_dir)
+    if fmt == 'snapshot':
+        store.import_json(leaderboards)
+        return
+
+    for chart_id, chart_scores in leaderboards.items():
+        with open(store.get_chart_file(chart_id), 'w', encoding='utf-8') as f:
+            json.dump({ 'chart_id': chart_id, 'last_crawled': time.time(), 'scores': chart_scores }, f, indent=2)
+
+def get_store_size(store_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(store_dir) if entry.is_file())
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+
+    return min(times)
+
+def measure_format(store_dir: str, fmt: str, repeat: int) -> dict:
+    """Time a store in one format.
+    @param store_dir: the store directory, already written in the format
+    @param fmt: the format, one of FORMATS
+    @param repeat: the number of timing runs; the best run is reported
+    @return: the format's measurements
+    """
+    store = LeaderboardStore(store_dir)
+    # read every file once, so that every timed run finds them in the page cache
+    scores = store.load(dict())
+    chart_ids = scores.keys()
+
+    # opening the store, then creating the Scores of every chart
+    open_time = best_time(lambda: store.load(dict()), repeat)
+    full_load_time = best_time(lambda: store.load(dict()).hydrate_all(), repeat)
+
+    # the first access to one chart, after the store is open
+    single_times = []
+    for _ in range(repeat):
+        scores = store.load(dict())
+        start_time = time.perf_counter()
+        scores.get(chart_ids[len(chart_ids) // 2])
+        single_times.append(time.perf_counter() - start_time)
+
+    # saving every chart in the format
+    scores = store.load(dict())
+    scores.hydrate_all()
+    if fmt == 'snapshot':
+        save_time = best_time(lambda: store.compact(scores), repeat)
+    else:
+        save_time = best_time(lambda: store.save_charts(scores, chart_ids), repeat)
+
+    return {
+        'format': fmt,
+        'charts': len(chart_ids),
+        'size_bytes': get_store_size(store_dir),
+        'open_s': round(open_time, 4),
+        'full_load_s': round(full_load_time, 4),
+        'single_chart_ms': round(min(single_times) * 1000, 3),
+        'save_all_s': round(save_time, 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the per-chart JSON files with the binary snapshot.')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='leaderboard.json, or a per-chart store directory such as data/leaderboard')
+    parser.add_argument('--synthetic-charts', type=int, help='measure this many generated charts instead of --input')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timing runs; the best run is reported')
+    parser.add_argument('--output', help='file to write the JSON report to; defaults to stdout')
+    args = parser.parse_args()
+
+    if args.synthetic_charts is not None:
+        leaderboards = { chart_id.lower(): chart_scores for chart_id, chart_scores in make_synthetic_leaderboards(args.synthetic_charts).items() }
+    elif os.path.exists(args.input):
+        leaderboards = read_leaderboards(args.input)
+    else:
+        parser.error(f'{args.input} does not exist; pass --input or --synthetic-charts')
+
+    results = []
+    for fmt in FORMATS:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            write_store(tmp_dir, leaderboards, fmt)
+            results.append(measure_format(tmp_dir, fmt, args.repeat))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    json_result, snapshot_result = results
+    report = json.dumps({
+        'input': 'synthetic' if args.synthetic_charts is not None else args.input,
+        'python': sys.version.split()[0],
+        'results': results,
+        'size_ratio': round(snapshot_result['size_bytes'] / json_result['size_bytes'], 3) if json_result['size_bytes'] > 0 else None,
+        'full_load_speedup': round(json_result['full_load_s'] / snapshot_result['full_load_s'], 2) if snapshot_result['full_load_s'] > 0 else None,
+    }, indent=2)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# memory_report.py
+# Compares the memory taken by the loaded chart leaderboards with the current Score and RankingDict layout against the previous one.
+# Each layout is loaded in its own process, so that one does not reuse memory freed by the other.
+# Usage: python bench/memory_report.py [--input data/leaderboard.json] [--synthetic-charts 4000] [--output report.json]
+
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from leaderboard_store import LeaderboardStore
+from ranking_dict import RankingDict
+from score import Score
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'leaderboard.json')
+
+LAYOUTS = ['legacy', 'slotted']
+
+class LegacyScore:
+    """The Score layout before it was slotted: a per-instance __dict__, a stored grade and unshared strings."""
+    def __init__(self, chart, player: str, score: int, rank: int, tie_count: int, avatar_id: str, date: str):
+        self.chart = chart
+        self.player = player
+        self.score = score
+        self.grade = Score.calculate_grade(score)
+        self.rank = rank
+        self.tie_count = tie_count
+        self.avatar_id = avatar_id
+        self.date = date
+
+class LegacyRankingDict(RankingDict):
+    """The RankingDict name index before lone player IDs were stored without a set; only loading is supported."""
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.players_by_name.setdefault(key.split('#')[0], set()).add(key)
+        dict.__setitem__(self, key, value)
+        self.rank_order = None
+
+# each layout's (score class, ranking class)
+LAYOUT_CLASSES = {
+    'legacy': (LegacyScore, LegacyRankingDict),
+    'slotted': (Score, RankingDict),
+}
+
+def get_rss() -> int:
+    """Get the process's current resident set size in bytes, or its peak where the current size is unavailable."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def read_leaderboards(path: str) -> dict:
+    """Read chart leaderboards from the single-file format, or from a directory in the per-chart store format.
+    @param path: the leaderboard file or store directory
+    @return: dict of { chart_id : dict of { player_id : score dict } }
+    """
+    if not os.path.isdir(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    return LeaderboardStore(path).export_json()
+
+def make_synthetic_leaderboards(num_charts: int, seed: int = 0) -> dict:
+    """Make chart leaderboards shaped like the real ones: 100 ranks per chart, drawn from a shared pool of players.
+    @param num_charts: the number of charts
+    @param seed: the random seed
+    @return: dict of { chart_id : dict of { player_id : score dict } }
+    """
+    rng = random.Random(seed)
+    players = [f'PLAYER{i}#{rng.randint(1000, 9999)}' for i in range(max(num_charts * 5, 100))]
+    avatars = [f'{i:03x}' for i in range(64)]
+
+    leaderboards = dict()
+    for chart in range(num_charts):
+        chart_scores = dict()
+        for rank, player_id in enumerate(rng.sample(players, 100), start=1):
+            # copy the strings, as json.load would, so that they are not already shared
+            player_id = ''.join(player_id)
+            chart_scores[player_id] = {
+                'player': ''.join(player_id),
+                'score': 1000000 - rank * rng.randint(100, 2000),
+                'grade': '',
+                'rank': rank,
+                'tie_count': 1,
+                'avatar_id': ''.join(rng.choice(avatars)),
+                'date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            }
+        leaderboards[f'Chart {chart} S{chart % 28 + 1}'] = chart_scores
+
+    return leaderboards
+
+def get_object_size(obj) -> int:
+    """Get the size of an object including its __dict__, if it has one."""
+    return sys.getsizeof(obj) + (sys.getsizeof(obj.__dict__) if hasattr(obj, '__dict__') else 0)
+
+def measure_layout(layout: str, path: str, trace: bool) -> dict:
+    """Load every chart leaderboard with a Score layout, as Leaderboard does, and measure the memory it takes.
+    @param layout: the layout, one of LAYOUTS
+    @param path: the leaderboard file or store directory
+    @param trace: measure the bytes allocated by Python with tracemalloc instead of the resident set size
+    @return: the layout's measurements
+    """
+    leaderboards = read_leaderboards(path)
+    score_cls, ranking_cls = LAYOUT_CLASSES[layout]
+
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    rss_before = get_rss()
+
+    scores = {
+        chart_id: ranking_cls({
+            player_id: score_cls(None, score['player'], score['score'], score['rank'], score['tie_count'], score['avatar_id'], score['date'])
+            for player_id, score in chart_scores.items()
+        })
+        for chart_id, chart_scores in leaderboards.items()
+    }
+
+    # drop the decoded JSON, so that only the strings the scores kept remain
+    del leaderboards
+    gc.collect()
+
+    num_scores = sum(len(chart_scores) for chart_scores in scores.values())
+
+    if trace:
+        # the bytes still allocated since loading began are the ones the scores and their rankings keep
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'retained_bytes': retained,
+            'retained_per_score_bytes': round(retained / num_scores, 1) if num_scores > 0 else None,
+        }
+
+    rss_after = get_rss()
+
+    return {
+        'layout': layout,
+        'charts': len(scores),
+        'scores': num_scores,
+        'score_object_bytes': get_object_size(next(iter(next(iter(scores.values())).values()))) if num_scores > 0 else None,
+        'rss_delta_bytes': rss_after - rss_before,
+        'rss_per_score_bytes': round((rss_after - rss_before) / num_scores, 1) if num_scores > 0 else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory taken by the loaded chart leaderboards with the legacy and slotted layouts.')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='leaderboard.json, or a per-chart store directory such as data/leaderboard')
+    parser.add_argument('--synthetic-charts', type=int, help='measure this many generated charts instead of --input')
+    parser.add_argument('--output', help='file to write the JSON report to; defaults to stdout')
+    parser.add_argument('--layout', choices=LAYOUTS, help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.layout is not None:
+        # measuring a single layout, in a child process
+        print(json.dumps(measure_layout(args.layout, args.input, args.trace)))
+        return
+
+    tmp_path = None
+    input_path = args.input
+    if args.synthetic_charts is not None:
+        fd, tmp_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(make_synthetic_leaderboards(args.synthetic_charts), f)
+        input_path = tmp_path
+    elif not os.path.exists(input_path):
+        parser.error(f'{input_path} does not exist; pass --input or --synthetic-charts')
+
+    try:
+        results = []
+        for layout in LAYOUTS:
+            layout_result = dict()
+            # tracing inflates the resident size, so each layout is measured once without and once with it
+            for trace in (False, True):
+                command = [sys.executable, os.path.abspath(__file__), '--layout', layout, '--input', input_path] + (['--trace'] if trace else [])
+                layout_result.update(json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout))
+            results.append(layout_result)
+    finally:
+        if tmp_path is not None:
+            os.remove(tmp_path)
+
+    legacy, slotted = results
+    report = json.dumps({
+        'input': 'synthetic' if args.synthetic_charts is not None else input_path,
+        'python': sys.version.split()[0],
+        'results': results,
+        'rss_saved_bytes': legacy['rss_delta_bytes'] - slotted['rss_delta_bytes'],
+        'rss_ratio': round(slotted['rss_delta_bytes'] / legacy['rss_delta_bytes'], 3) if legacy['rss_delta_bytes'] > 0 else None,
+        'retained_saved_bytes': legacy['retained_bytes'] - slotted['retained_bytes'],
+        'retained_ratio': round(slotted['retained_bytes'] / legacy['retained_bytes'], 3) if legacy['retained_bytes'] > 0 else None,
+    }, indent=2)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
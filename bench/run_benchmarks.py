@@ -0,0 +1,269 @@
+# run_benchmarks.py
+# Offline benchmarks for the leaderboard parsers, diff step and embed rendering, run against the saved pages in bench/fixtures.
+# Usage: python bench/run_benchmarks.py [--output results.json] [--repeat 5] [--filter name]
+
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import os
+import platform
+import sys
+import timeit
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fuzzywuzzy import process
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from chart import Chart
+from chart_search import ChartSearchIndex
+from leaderboard_crawler import LeaderboardCrawler
+from leaderboard_diff import diff_rankings
+from piugame_crawler import PIUGAME_CRAWLER
+from player_index import PlayerIndex
+import pumbility
+import score as score_module
+from pumbility_crawler import PumbilityCrawler
+from ranking_dict import RankingDict
+from score import Score
+from songlist_crawler import SonglistCrawler
+from util import update_curr_tie_count, update_next_tie_count
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+CHART_FIXTURES = [
+    'chart_leaderboard.html',
+    'chart_leaderboard_ties.html',
+    'chart_leaderboard_medals.html',
+]
+PUMBILITY_FIXTURE = 'pumbility_ranking.html'
+SONGLIST_FIXTURE = 'songlist_page.html'
+SONGLIST_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'songlist.csv')
+
+# mistyped, abbreviated and hinted chart queries, as users send them
+CHART_QUERIES = [
+    'grhoth d24',
+    'ghroth sc d24',
+    'hymn of golden glory s23',
+    'destin',
+    'acquire co-op x3',
+]
+
+CHART_ROWS_XPATH = '//div[@class="rangking_list_w"]//ul[@class="list"]/li'
+PUMBILITY_ROWS_XPATH = '//ul[@class="list pumbilitySt"]/li'
+SONGLIST_ROWS_XPATH = '//ul[@class="rating_ranking_list flex wrap overRangking_st"]/li'
+
+PARSER_MODES = ['legacy', 'compiled']
+
+FIXTURE_CHART = Chart(title='Fixture', mode='Single', level='22', leaderboard_id='fixture', thumbnail_url='')
+
+def load_response(fixture: str) -> HtmlResponse:
+    url = f'https://phoenix.piugame.com/fixtures/{fixture}'
+    with open(os.path.join(FIXTURES_DIR, fixture), 'rb') as f:
+        return HtmlResponse(url=url, body=f.read(), encoding='utf-8', request=Request(url))
+
+def time_call(func, repeat: int) -> tuple[float, int]:
+    """Time a function.
+    @param func: the function to time
+    @param repeat: the number of timing runs
+    @return: (best seconds per call, calls per run)
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number, number
+
+def parse_rows(ranking_list, mode: str, pumbility: bool) -> list:
+    PIUGAME_CRAWLER.parser_mode = mode
+    return [PIUGAME_CRAWLER.parse_row(ranking, pumbility=pumbility) for ranking in ranking_list]
+
+def parse_chart(response: HtmlResponse, scores: dict):
+    spider = LeaderboardCrawler(leaderboard_urls={ response.url: FIXTURE_CHART }, scores=scores, change_events=[], updated_charts=set(),
+                                player_index=PlayerIndex(), crawl_stats=Counter())
+    spider.parse(response)
+    return spider
+
+def parse_pumbility(response: HtmlResponse):
+    spider = PumbilityCrawler(pumbility_ranking=RankingDict(), pumbility_updates=[])
+    spider.parse(response)
+    return spider
+
+def compute_ties(rows: list) -> RankingDict:
+    """Run the tie computation from LeaderboardCrawler.parse over already parsed rows."""
+    scores_dict = RankingDict()
+
+    tie_count = 1
+    previous_rank = 0
+    previous_player_id = ''
+    curr_tied_players = []
+
+    for i, (rank, player_id, score, avatar_id, date, _) in enumerate(rows):
+        tie_count = update_curr_tie_count(tie_count, rank, previous_rank, player_id, previous_player_id, curr_tied_players)
+        scores_dict[player_id] = Score(chart=FIXTURE_CHART, player=player_id, score=score, rank=rank, tie_count=tie_count, avatar_id=avatar_id, date=date)
+        tie_count = update_next_tie_count(tie_count, rank, previous_rank, i, player_id, scores_dict, rows, curr_tied_players)
+
+        previous_rank = rank
+        previous_player_id = player_id
+
+    return scores_dict
+
+def bump_scores(scores: RankingDict) -> RankingDict:
+    """Make a copy of a chart's scores where every tenth player improved, to diff against."""
+    bumped = RankingDict()
+    for i, (player_id, score) in enumerate(scores.items()):
+        new_score = score.score + 10 if i % 10 == 0 else score.score
+        bumped[player_id] = Score(chart=score.chart, player=player_id, score=new_score, rank=score.rank, tie_count=score.tie_count,
+                                  avatar_id=score.avatar_id, date=score.date)
+    return bumped
+
+def clear_render_caches():
+    score_module.get_chart_header.cache_clear()
+    score_module.render_description.cache_clear()
+    pumbility.render_description.cache_clear()
+
+async def render_scores(scores: RankingDict):
+    for score in scores.values():
+        await score.make_embed(prev_score=None, compare=False)
+        score.get_icon()
+
+async def render_pumbilities(pumbility_ranking: RankingDict):
+    for player_pumbility in pumbility_ranking.values():
+        await player_pumbility.embed(prev_pumbility=None, compare=False)
+
+def load_songlist() -> dict[str, Chart]:
+    charts = dict()
+    with open(SONGLIST_FILE, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            chart = Chart(title=row['title'], mode=row['mode'], level=row['level'], leaderboard_id=row['id'], thumbnail_url=row['thumbnail'])
+            charts[chart.chart_id.lower()] = chart
+
+    return charts
+
+def result(name: str, fixture: str, rows: int, seconds: float, calls: int) -> dict:
+    return {
+        'name': name,
+        'fixture': fixture,
+        'rows': rows,
+        'calls_per_run': calls,
+        'per_page_us': round(seconds * 1e6, 2),
+        'per_row_us': round(seconds * 1e6 / rows, 3) if rows > 0 else None,
+    }
+
+def run_benchmarks(repeat: int, name_filter: str) -> tuple[list, list]:
+    """Run every benchmark.
+    @param repeat: the number of timing runs per benchmark
+    @param name_filter: only run benchmarks whose name contains this, if given
+    @return: (list of results, list of parser mismatches)
+    """
+    results = []
+    mismatches = []
+    loop = asyncio.new_event_loop()
+
+    def bench(name: str, fixture: str, rows: int, func):
+        if name_filter is None or name_filter in name:
+            seconds, calls = time_call(func, repeat)
+            results.append(result(name, fixture, rows, seconds, calls))
+
+    for fixture in CHART_FIXTURES:
+        response = load_response(fixture)
+        ranking_list = response.xpath(CHART_ROWS_XPATH)
+        rows = len(ranking_list)
+
+        parsed = { mode: parse_rows(ranking_list, mode, pumbility=False) for mode in PARSER_MODES }
+        if parsed['legacy'] != parsed['compiled']:
+            mismatches.append(fixture)
+
+        for mode in PARSER_MODES:
+            PIUGAME_CRAWLER.parser_mode = mode
+            bench(f'chart.parse[{mode}]', fixture, rows, lambda: parse_chart(response, dict()))
+            bench(f'chart.parse_rows[{mode}]', fixture, rows, lambda: [PIUGAME_CRAWLER.parse_row(ranking, pumbility=False) for ranking in ranking_list])
+
+        # a recrawl of an identical page stops at the ranking list digest
+        prev_scores = dict()
+        parse_chart(response, prev_scores)
+        bench('chart.parse[unchanged]', fixture, rows, lambda: parse_chart(response, prev_scores))
+
+        scores = compute_ties(parsed['compiled'])
+        bumped_scores = bump_scores(scores)
+        bench('chart.ties', fixture, rows, lambda: compute_ties(parsed['compiled']))
+        bench('chart.diff', fixture, rows, lambda: diff_rankings(FIXTURE_CHART.chart_id.lower(), scores, bumped_scores))
+
+        # uncached renders every embed from scratch, as a fresh process would
+        bench('render.score[uncached]', fixture, rows, lambda: (clear_render_caches(), loop.run_until_complete(render_scores(scores))))
+        bench('render.score[cached]', fixture, rows, lambda: loop.run_until_complete(render_scores(scores)))
+
+    response = load_response(PUMBILITY_FIXTURE)
+    ranking_list = response.xpath(PUMBILITY_ROWS_XPATH)
+    rows = len(ranking_list)
+
+    parsed = { mode: parse_rows(ranking_list, mode, pumbility=True) for mode in PARSER_MODES }
+    if parsed['legacy'] != parsed['compiled']:
+        mismatches.append(PUMBILITY_FIXTURE)
+
+    for mode in PARSER_MODES:
+        PIUGAME_CRAWLER.parser_mode = mode
+        bench(f'pumbility.parse[{mode}]', PUMBILITY_FIXTURE, rows, lambda: parse_pumbility(response))
+
+    pumbility_ranking = parse_pumbility(response).pumbility_ranking
+    bench('render.pumbility[uncached]', PUMBILITY_FIXTURE, rows,
+          lambda: (clear_render_caches(), loop.run_until_complete(render_pumbilities(pumbility_ranking))))
+    bench('render.pumbility[cached]', PUMBILITY_FIXTURE, rows, lambda: loop.run_until_complete(render_pumbilities(pumbility_ranking)))
+
+    response = load_response(SONGLIST_FIXTURE)
+    ranking_list = response.xpath(SONGLIST_ROWS_XPATH)
+    songlist_crawler = SonglistCrawler()
+
+    def parse_songlist():
+        songlist_crawler.songlist = []
+        for ranking in ranking_list:
+            songlist_crawler.parse_ranking(ranking)
+
+    bench('songlist.parse_ranking', SONGLIST_FIXTURE, len(ranking_list), parse_songlist)
+
+    # chart lookups report the time per query, against every chart in the songlist
+    charts = load_songlist()
+    chart_search = ChartSearchIndex()
+    chart_search.build(charts)
+    songlist_file = os.path.basename(SONGLIST_FILE)
+    bench('chart.search[fuzzy]', songlist_file, len(CHART_QUERIES),
+          lambda: [process.extractBests(query, charts.keys(), score_cutoff=60, limit=10) for query in CHART_QUERIES])
+    bench('chart.search[indexed]', songlist_file, len(CHART_QUERIES), lambda: [chart_search.search(query) for query in CHART_QUERIES])
+    bench('chart.search.build', songlist_file, len(charts), lambda: chart_search.build(charts))
+
+    loop.close()
+
+    return results, mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the offline parser, diff and rendering benchmarks.')
+    parser.add_argument('--output', help='file to write the JSON results to; defaults to stdout')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs per benchmark; the best run is reported')
+    parser.add_argument('--filter', dest='name_filter', help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    results, mismatches = run_benchmarks(args.repeat, args.name_filter)
+
+    report = json.dumps({
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parser_mismatches': mismatches,
+        'results': results,
+    }, indent=2)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+    # the compiled and legacy parsers must agree on every fixture
+    if len(mismatches) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
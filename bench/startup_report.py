@@ -0,0 +1,129 @@
+# startup_report.py
+# Times loading the chart leaderboards at startup, hydrating every chart up front as before against hydrating charts on first access.
+# Usage: python bench/startup_report.py [--input data/leaderboard] [--synthetic-charts 1250] [--repeat 3] [--output report.json]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from leaderboard_store import LeaderboardStore
+from memory_report import make_synthetic_leaderboards
+from player_index import PlayerIndex
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'leaderboard')
+
+MODES = ['eager', 'lazy']
+
+def write_synthetic_store(store_dir: str, num_charts: int):
+    """Write generated chart leaderboards in the per-chart store format.
+    @param store_dir: the directory to write the charts to
+    @param num_charts: the number of charts
+    @return: None
+    """
+    store = LeaderboardStore(store_dir)
+    for chart_id, chart_scores in make_synthetic_leaderboards(num_charts).items():
+        chart_id = chart_id.lower()
+        with open(store.get_chart_file(chart_id), 'w', encoding='utf-8') as f:
+            json.dump({ 'chart_id': chart_id, 'last_crawled': time.time(), 'scores': chart_scores }, f, indent=2)
+
+def load(store_dir: str, eager: bool):
+    """Load the chart leaderboards and the player index the way Leaderboard does at startup.
+    @param store_dir: the per-chart store directory
+    @param eager: whether to hydrate every chart up front
+    @return: (LazyScores, PlayerIndex)
+    """
+    scores = LeaderboardStore(store_dir).load(dict())
+
+    player_index = PlayerIndex(load_chart=scores.get)
+    for chart_id in scores.keys():
+        player_index.add_chart_players(chart_id, scores.get_player_ids(chart_id))
+    scores.on_hydrate = lambda chart_id, chart_scores: player_index.update_chart(chart_id, None, chart_scores)
+
+    if eager:
+        scores.hydrate_all()
+
+    return scores, player_index
+
+def measure(store_dir: str, repeat: int) -> dict:
+    """Time startup in each mode, and the cost of the first access to a chart when loading lazily.
+    @param store_dir: the per-chart store directory
+    @param repeat: the number of timing runs per mode; the best run is reported
+    @return: the measurements
+    """
+    # read every file once, so that every timed run finds them in the page cache
+    load(store_dir, eager=False)
+
+    results = []
+    for mode in MODES:
+        times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            scores, _ = load(store_dir, eager=mode == 'eager')
+            times.append(time.perf_counter() - start_time)
+
+        results.append({ 'mode': mode, 'charts': len(scores), 'time_to_ready_s': round(min(times), 4) })
+
+    scores, player_index = load(store_dir, eager=False)
+    chart_ids = scores.keys()[:100]
+
+    start_time = time.perf_counter()
+    for chart_id in chart_ids:
+        scores.get(chart_id)
+    first_access = (time.perf_counter() - start_time) / len(chart_ids) if len(chart_ids) > 0 else None
+
+    # a player lookup hydrates every chart the player is on
+    player_id = next(iter(scores.get_player_ids(scores.keys()[-1])), None) if len(scores) > 0 else None
+    start_time = time.perf_counter()
+    entries = player_index.find(player_id) if player_id is not None else []
+    player_lookup = time.perf_counter() - start_time
+
+    return {
+        'results': results,
+        'first_chart_access_ms': round(first_access * 1000, 3) if first_access is not None else None,
+        'first_player_lookup_ms': round(player_lookup * 1000, 3),
+        'first_player_lookup_charts': len(entries),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Time loading the chart leaderboards eagerly and lazily.')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='the per-chart store directory')
+    parser.add_argument('--synthetic-charts', type=int, help='measure this many generated charts instead of --input')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timing runs per mode; the best run is reported')
+    parser.add_argument('--output', help='file to write the JSON report to; defaults to stdout')
+    args = parser.parse_args()
+
+    tmp_dir = None
+    store_dir = args.input
+    if args.synthetic_charts is not None:
+        tmp_dir = tempfile.mkdtemp()
+        store_dir = tmp_dir
+        write_synthetic_store(store_dir, args.synthetic_charts)
+    elif not os.path.isdir(store_dir):
+        parser.error(f'{store_dir} does not exist; pass --input or --synthetic-charts')
+
+    try:
+        report = measure(store_dir, args.repeat)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    report = json.dumps({
+        'input': 'synthetic' if args.synthetic_charts is not None else store_dir,
+        'python': sys.version.split()[0],
+        **report,
+    }, indent=2)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
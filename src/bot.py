@@ -3,33 +3,87 @@
 import datetime
 import logging
 import os
+import re
 import sys
+import time
 from typing import List
 
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 
-from bot_help import LeaderboardHelpCommand, COMMAND_CHANNELS, UPDATE_CHANNELS
+from bot_help import LeaderboardHelpCommand
+from channel_router import ChannelRouter
 from guild_leaderboard import GuildLeaderboard
 from leaderboard import Leaderboard
 from leaderboard_dict import LeaderboardDict
+from outbound_queue import OutboundQueue
+from subscription_index import SubscriptionIndex
+from util import get_rank_suffix
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+# syncing the slash commands is rate limited by discord, so it is only done at startup when asked for
+SYNC_SLASH_COMMANDS = os.getenv('SYNC_SLASH_COMMANDS', 'false').lower() == 'true'
 
 INVALID_RANK_RANGE_MSG = 'Invalid rank parameter. Please ensure you are using the format `rank` or `rank-rank`'
 INT_ERR_MSG  = '. One or more of the arguments could not be parsed as an integer'
 LVL_NOT_FOUND_MSG = '`"{}"` was not found. Please ensure you are using the format `"Song title (S/D/Co-op)(Level)"`'
 QUERY_ERR_MSG = 'An error occurred while querying the leaderboard. Please try again later'
-
-leaderboards = LeaderboardDict(GuildLeaderboard)
+INVALID_FILTER_MSG = 'Invalid level parameter. Please ensure you are using the format `(S/D/Co-op)[Level]` or `Level`, e.g. `S22`, `D`, `Co-opx2`'
+WRONG_CHANNEL_MSG = 'Commands can only be used in the `piu-leaderboard` or `piu-leaderboard-commands` channels.'
+
+MAX_MESSAGE_LENGTH = 2000
+# the most scores !queryall lists, so that a prolific player does not flood the channel with messages
+MAX_QUERYALL_SCORES = 100
+# discord limits autocomplete to 25 choices of at most 100 characters
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+CHART_FILTER_MODES = {
+    's': 'Single',
+    'd': 'Double',
+    'co-op': 'Co-op',
+}
+
+# startup time, to report how long the bot took to become ready
+START_TIME = time.perf_counter()
+
+subscriptions = SubscriptionIndex()
+leaderboards = LeaderboardDict(lambda guild_id: GuildLeaderboard(guild_id, subscriptions))
 leaderboard = Leaderboard()
+outbound = OutboundQueue()
 
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+class LeaderboardBot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # each guild's update and command channels, kept current by the channel and guild events
+        self.channel_router = ChannelRouter()
+
+    async def setup_hook(self):
+        await leaderboard.start()
+
+        if SYNC_SLASH_COMMANDS:
+            await self.sync_slash_commands()
+
+    async def sync_slash_commands(self) -> int:
+        """ Register the slash variants of the hybrid commands with discord.
+        @return: the number of slash commands synced
+        """
+        synced = await self.tree.sync()
+        logger.info(f'Synced {len(synced)} slash commands')
+        return len(synced)
+
+    async def close(self):
+        # make sure pending leaderboard saves reach the disk before shutting down
+        await leaderboard.close()
+        await super().close()
+
+bot = LeaderboardBot(command_prefix='!', intents=intents)
 
 logger = logging.getLogger('discord')
 logger.setLevel(logging.DEBUG)
@@ -42,14 +96,38 @@ logger.addHandler(file_handler)
 
 @bot.event
 async def on_ready():
-    logger.info(f'{bot.user} is connected to the following guilds:')
+    logger.info(f'{bot.user} is ready {time.perf_counter() - START_TIME:.2f}s after startup, connected to the following guilds:')
 
     for guild in bot.guilds:
-        leaderboards[guild.id] = GuildLeaderboard(guild.id)
+        leaderboards[guild.id] = GuildLeaderboard(guild.id, subscriptions)
+        bot.channel_router.refresh_guild(guild)
         logger.info(f'{guild.name}(id: {guild.id})')
 
     update_leaderboard.start()
     update_pumbility.start()
+    update_songlist.start()
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    bot.channel_router.refresh_guild(guild)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    bot.channel_router.remove_guild(guild.id)
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    bot.channel_router.refresh_guild(channel.guild)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    bot.channel_router.refresh_guild(channel.guild)
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    # renames and moves can change which channels match
+    if before.name != after.name or before.position != after.position:
+        bot.channel_router.refresh_guild(after.guild)
 
 @bot.event
 async def on_command_error(ctx: commands.Context, error: commands.errors.CommandError):
@@ -60,7 +138,7 @@ async def on_command_error(ctx: commands.Context, error: commands.errors.Command
 
 @bot.command(name='track', help='Begin tracking a player\'s scores')
 async def track(ctx: commands.Context, player_id: str):
-    if ctx.channel.name not in COMMAND_CHANNELS:
+    if not bot.channel_router.is_command_channel(ctx.channel):
         return
 
     if await leaderboards[ctx.guild.id].add_player(player_id):
@@ -70,7 +148,7 @@ async def track(ctx: commands.Context, player_id: str):
 
 @bot.command(name='untrack', help='Stop tracking a player\'s scores')
 async def untrack(ctx: commands.Context, player_id: str):
-    if ctx.channel.name not in COMMAND_CHANNELS:
+    if not bot.channel_router.is_command_channel(ctx.channel):
         return
 
     if await leaderboards[ctx.guild.id].remove_player(player_id):
@@ -80,7 +158,7 @@ async def untrack(ctx: commands.Context, player_id: str):
 
 @bot.command(name='tracking', help='List all players being currently tracked')
 async def tracking(ctx: commands.Context):
-    if ctx.channel.name not in COMMAND_CHANNELS:
+    if not bot.channel_router.is_command_channel(ctx.channel):
         return
 
     if len(leaderboards[ctx.guild.id].players) == 0:
@@ -91,9 +169,46 @@ async def tracking(ctx: commands.Context):
         player_names = player_names.replace('\\#', '＃')
         await ctx.send(f'Currently tracking the following players: ```\n{player_names}```')
 
-@bot.command(name='querypu', help='Query a player\'s Pumbility Ranking')
+@bot.command(name='sync', hidden=True, help='Register the slash commands with discord, after they have changed')
+@commands.is_owner()
+async def sync(ctx: commands.Context):
+    num_synced = await bot.sync_slash_commands()
+    await ctx.send(f'Synced {num_synced} slash commands')
+
+async def in_command_channel(ctx: commands.Context) -> bool:
+    if bot.channel_router.is_command_channel(ctx.channel):
+        return True
+
+    # slash commands must be answered, so they are told why they were ignored
+    if ctx.interaction is not None:
+        await ctx.send(WRONG_CHANNEL_MSG, ephemeral=True)
+    return False
+
+async def chart_id_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    choices = []
+    for chart_id in leaderboard.complete_chart_ids(current, MAX_CHOICES):
+        if len(chart_id) <= MAX_CHOICE_LENGTH:
+            name = ' '.join(leaderboard.charts[chart_id].chart_id.split())[:MAX_CHOICE_LENGTH]
+            choices.append(app_commands.Choice(name=name, value=chart_id))
+
+    return choices
+
+async def player_ids_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    # only the last of the comma-separated player IDs is completed
+    *previous, prefix = current.split(',')
+    choices = []
+    for player_id in leaderboard.complete_player_ids(prefix, MAX_CHOICES):
+        value = ','.join(previous + [player_id])
+        if len(value) <= MAX_CHOICE_LENGTH:
+            choices.append(app_commands.Choice(name=value, value=value))
+
+    return choices
+
+@bot.hybrid_command(name='querypu', help='Query a player\'s Pumbility Ranking')
+@app_commands.describe(player_ids='name[#tag], or several separated by commas')
+@app_commands.autocomplete(player_ids=player_ids_autocomplete)
 async def querypu(ctx: commands.Context, player_ids: str):
-    if ctx.channel.name not in COMMAND_CHANNELS:
+    if not await in_command_channel(ctx):
         return
 
     async with ctx.typing():
@@ -113,9 +228,11 @@ async def querypu(ctx: commands.Context, player_ids: str):
             for pumbility in pumbilities:
                 await ctx.send(embed=await pumbility.embed(prev_pumbility=None, compare=False))
 
-@bot.command(name='queryp', help='Query a player\'s rank on a level')
+@bot.hybrid_command(name='queryp', help='Query a player\'s rank on a level')
+@app_commands.describe(player_ids='name[#tag], or several separated by commas', chart_id='Song title (S/D/Co-op)(Level)')
+@app_commands.autocomplete(player_ids=player_ids_autocomplete, chart_id=chart_id_autocomplete)
 async def queryp(ctx: commands.Context, player_ids: str, chart_id: str):
-    if ctx.channel.name not in COMMAND_CHANNELS:
+    if not await in_command_channel(ctx):
         return
 
     async with ctx.typing():
@@ -138,9 +255,11 @@ async def queryp(ctx: commands.Context, player_ids: str, chart_id: str):
         else:
             await ctx.send(LVL_NOT_FOUND_MSG.format(chart_id))
 
-@bot.command(name='queryr', help='Query a specific rank on a level')
+@bot.hybrid_command(name='queryr', help='Query a specific rank on a level')
+@app_commands.describe(rank='rank[-rank], between 1 and 100', chart_id='Song title (S/D/Co-op)(Level)')
+@app_commands.autocomplete(chart_id=chart_id_autocomplete)
 async def queryr(ctx: commands.Context, rank: str, chart_id: str):
-    if ctx.channel.name not in COMMAND_CHANNELS:
+    if not await in_command_channel(ctx):
         return
 
     async with ctx.typing():
@@ -148,22 +267,10 @@ async def queryr(ctx: commands.Context, rank: str, chart_id: str):
             chart_id = new_chart_id
             rank_range = await get_rank_range(ctx, rank)
             if rank_range and len(rank_range) >= 2:
-                scores = []
-                i = rank_range[0]
-                while i <= rank_range[1]:
-                    curr_scores = await leaderboard.query_rank(i, chart_id)
-                    if curr_scores is None:
-                        await ctx.send(QUERY_ERR_MSG)
-                        return
-                    else:
-                        scores.extend(curr_scores)
-
-                        # skip to the next non-tied rank
-                        if len(curr_scores) > 1:
-                            i = curr_scores[0].rank + len(curr_scores)
-                            continue
-
-                    i += 1
+                scores = await leaderboard.query_rank_range(rank_range[0], rank_range[1], chart_id)
+                if scores is None:
+                    await ctx.send(QUERY_ERR_MSG)
+                    return
 
                 if len(scores) == 0:
                     await ctx.send(f'No scores with rank(s) {rank} on {chart_id}.')
@@ -174,6 +281,93 @@ async def queryr(ctx: commands.Context, rank: str, chart_id: str):
         else:
             await ctx.send(LVL_NOT_FOUND_MSG.format(chart_id))
 
+@bot.command(name='queryall', help='Query all of a player\'s ranks, optionally filtered by mode/level')
+async def queryall(ctx: commands.Context, player_ids: str, level: str = None):
+    if not bot.channel_router.is_command_channel(ctx.channel):
+        return
+
+    mode, level_num = None, None
+    if level is not None:
+        if (chart_filter := await get_chart_filter(ctx, level)) is None:
+            return
+        mode, level_num = chart_filter
+
+    player_ids = player_ids.split(',')
+    scores = await leaderboard.query_player_scores(player_ids, mode, level_num)
+
+    if len(scores) == 0:
+        filter_text = f' matching `{level}`' if level is not None else ''
+        await ctx.send(f'No scores for `{", ".join(player_ids)}` on any leaderboard{filter_text}.')
+    else:
+        lines = [f'{score.rank:>3}{get_rank_suffix(score.rank)}  {format(score.score, ","):>9}  {score.player}  {score.chart.chart_id}'
+                 for score in scores[:MAX_QUERYALL_SCORES]]
+        await send_code_block(ctx, lines)
+
+        if len(scores) > MAX_QUERYALL_SCORES:
+            await ctx.send(f'Showing the best {MAX_QUERYALL_SCORES} of {len(scores)} ranks. Add a level, e.g. `S22` or `D`, to see the rest.')
+
+@bot.command(name='history', help='Show a player\'s score progression on a level')
+async def history(ctx: commands.Context, player_ids: str, chart_id: str):
+    if not await in_command_channel(ctx):
+        return
+
+    async with ctx.typing():
+        if (new_chart_id := await leaderboard.rescrape_chart(bot, ctx, chart_id)):
+            chart_id = new_chart_id
+            player_ids = player_ids.split(',')
+            history = await leaderboard.query_score_history(player_ids, chart_id)
+
+            if len(history) == 0:
+                await ctx.send(f'No score history for `{", ".join(player_ids)}` on {chart_id}.')
+            else:
+                await send_code_block(ctx, get_history_lines(history, f'on {leaderboard.charts[chart_id].chart_id.strip()}'))
+        else:
+            await ctx.send(LVL_NOT_FOUND_MSG.format(chart_id))
+
+@bot.command(name='historypu', help='Show a player\'s Pumbility over time')
+async def historypu(ctx: commands.Context, player_ids: str):
+    if not await in_command_channel(ctx):
+        return
+
+    player_ids = player_ids.split(',')
+    history = await leaderboard.query_pumbility_history(player_ids)
+
+    if len(history) == 0:
+        await ctx.send(f'No Pumbility history for `{", ".join(player_ids)}`.')
+    else:
+        await send_code_block(ctx, get_history_lines(history, 'Pumbility'))
+
+def get_history_lines(history: dict, label: str) -> List[str]:
+    lines = []
+    for player_id, records in history.items():
+        lines.append(f'{player_id} {label}')
+        for record in records:
+            date = datetime.datetime.fromtimestamp(record.timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+            lines.append(f'  {date}  {format(record.value, ","):>9}  {record.rank:>3}{get_rank_suffix(record.rank)}')
+
+    return lines
+
+async def get_chart_filter(ctx: commands.Context, chart_filter: str) -> tuple[str, str]:
+    match = re.fullmatch(r'(s|d|co-op)?(x?[0-9]+)?', chart_filter.replace(' ', '').lower())
+    if match is None or chart_filter.strip() == '':
+        await ctx.send(INVALID_FILTER_MSG)
+        return None
+
+    mode = CHART_FILTER_MODES[match.group(1)] if match.group(1) is not None else None
+    return mode, match.group(2)
+
+async def send_code_block(ctx: commands.Context, lines: List[str]):
+    # split the lines across as many messages as needed to stay under discord's length limit
+    message = ''
+    for line in lines:
+        if len(message) + len(line) + 1 > MAX_MESSAGE_LENGTH - len('```\n```'):
+            await ctx.send(f'```\n{message}```')
+            message = ''
+        message += f'{line}\n'
+
+    if len(message) > 0:
+        await ctx.send(f'```\n{message}```')
+
 async def get_rank_range(ctx: commands.Context, rank: str) -> List[int]:
     rank = rank.replace(' ', '')
     if '-' in rank:
@@ -203,15 +397,18 @@ async def get_rank_range(ctx: commands.Context, rank: str) -> List[int]:
 @tasks.loop(minutes=20)
 async def update_leaderboard():
     logger.info('Updating leaderboards')
-    await leaderboard.update_all_charts()
+    await leaderboard.update_all_charts(subscriptions.get_tracked_players())
+    await leaderboard.publish_score_updates()
     logger.info('Leaderboards updated')
 
-    for guild in bot.guilds:
-        for channel in guild.text_channels:
-            if channel.name in UPDATE_CHANNELS:
-                await leaderboards[guild.id].get_leaderboard_updates(leaderboard, channel)
-                break
+    guild_updates = subscriptions.route(leaderboard.score_updates, lambda update: update[0].player)
+
+    for guild_id, updates in guild_updates.items():
+        channel = bot.channel_router.get_update_channel(guild_id)
+        if channel is not None:
+            await leaderboards[guild_id].get_leaderboard_updates(updates, channel, outbound)
 
+    await outbound.flush()
     logger.info('Leaderboard updates sent')
 
 @tasks.loop(minutes=180)
@@ -219,13 +416,26 @@ async def update_pumbility():
     logger.info('Updating Pumbility leaderboard')
     await leaderboard.update_pumbility()
     await leaderboard.save_pumbility_leaderboard()
+    await leaderboard.publish_pumbility_updates()
     logger.info('Pumbility leaderboard updated')
 
-    for guild in bot.guilds:
-        for channel in guild.text_channels:
-            if channel.name in UPDATE_CHANNELS:
-                await leaderboards[guild.id].get_pumbility_updates(leaderboard, channel)
-                break
+    guild_updates = subscriptions.route(leaderboard.pumbility_updates, lambda update: update[0].player_id)
+
+    for guild_id, updates in guild_updates.items():
+        channel = bot.channel_router.get_update_channel(guild_id)
+        if channel is not None:
+            await leaderboards[guild_id].get_pumbility_updates(updates, channel, outbound)
+
+    await outbound.flush()
+
+@tasks.loop(hours=1)
+async def update_songlist():
+    # the songlist is refreshed once per SONGLIST_REFRESH_HOURS, counting from when it was last saved
+    if leaderboard.is_songlist_fresh():
+        return
+
+    logger.info('Refreshing songlist')
+    await leaderboard.refresh_songlist()
 
 bot.help_command = LeaderboardHelpCommand()
 bot.run(TOKEN)
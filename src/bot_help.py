@@ -11,7 +11,7 @@ COMMAND_CHANNELS = set([DEFAULT_CHANNEL_NAME, COMMANDS_CHANNEL_NAME])
 
 class LeaderboardHelpCommand(commands.HelpCommand):
     async def send_bot_help(self, mapping):
-        if self.context.channel.name not in COMMAND_CHANNELS:
+        if not self.context.bot.channel_router.is_command_channel(self.context.channel):
             return
 
         # Create a list to hold the pages
@@ -19,6 +19,11 @@ class LeaderboardHelpCommand(commands.HelpCommand):
 
         # Add a page for each cog and its commands
         for category, commands in mapping.items():
+            # leave out hidden commands and those the user cannot run, e.g. owner-only ones, sorted alphabetically
+            commands = await self.filter_commands(commands, sort=True)
+            if len(commands) == 0:
+                continue
+
             if category is None:
                 category = 'No Category'
             pages.append(f'{category}:')
@@ -26,9 +31,6 @@ class LeaderboardHelpCommand(commands.HelpCommand):
             max_cmd_width = max(len(command.qualified_name) for command in commands)
             max_sig_width = max(len(self.get_command_signature(command)) for command in commands)
 
-            # sort commands alphabetically
-            commands = sorted(commands, key=lambda command: command.qualified_name)
-
             for command in commands:
                 cmd_spaces_to_add = max_cmd_width - len(command.qualified_name) + 2
                 cmd_spaces = ' ' * cmd_spaces_to_add
@@ -41,6 +43,7 @@ class LeaderboardHelpCommand(commands.HelpCommand):
         pages.append('\nParameters (case-insensitive): ')
         pages.append('\t<chart_id>   "Song title (S/D/Co-op)(Level)"  | must be enclosed in quotes; for Co-op chart levels, use x2, x3, etc...\n'
                      '\t<player_id>  name[#tag][,name2[#tag2],...]    | if #tag is not specified, all scores with a matching name will be returned\n'
-                     '\t<rank>       rank[-rank]                      | ranks must be between 1 and 100; can optionally specify a range of ranks to query\n')
+                     '\t<rank>       rank[-rank]                      | ranks must be between 1 and 100; can optionally specify a range of ranks to query\n'
+                     '\t<level>      [S/D/Co-op][Level]               | filters by mode and/or level; e.g. S22, D, Co-opx2 or 20\n')
 
         await self.get_destination().send('```' + '\n'.join(pages) + '```')
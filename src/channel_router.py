@@ -0,0 +1,51 @@
+# channel_router.py
+# Keeps track of each guild's update and command channels, so that they can be looked up without scanning the guild's channels.
+
+import discord
+
+from bot_help import COMMAND_CHANNELS, UPDATE_CHANNELS
+
+class ChannelRouter:
+    def __init__(self):
+        """Initialize the channel router. It is empty until guilds are added with refresh_guild."""
+        # update_channels is dict of { guild_id : the channel that the guild's updates are sent to }
+        self.update_channels = dict()
+        # command_channels is dict of { guild_id : set of the ids of the channels that commands may be used in }
+        self.command_channels = dict()
+
+    def refresh_guild(self, guild: discord.Guild):
+        """Find a guild's update and command channels, e.g. when the bot joins it or its channels change.
+        @param guild: the guild
+        @return: None
+        """
+        # text_channels is sorted by position, so the topmost matching channel receives the updates
+        update_channel = next((channel for channel in guild.text_channels if channel.name in UPDATE_CHANNELS), None)
+        if update_channel is not None:
+            self.update_channels[guild.id] = update_channel
+        else:
+            self.update_channels.pop(guild.id, None)
+
+        self.command_channels[guild.id] = set(channel.id for channel in guild.text_channels if channel.name in COMMAND_CHANNELS)
+
+    def remove_guild(self, guild_id: int):
+        """Forget a guild the bot was removed from.
+        @param guild_id: the guild's ID
+        @return: None
+        """
+        self.update_channels.pop(guild_id, None)
+        self.command_channels.pop(guild_id, None)
+
+    def get_update_channel(self, guild_id: int) -> discord.TextChannel:
+        """Get the channel that a guild's updates are sent to.
+        @param guild_id: the guild's ID
+        @return: the channel, or None if the guild has no update channel
+        """
+        return self.update_channels.get(guild_id)
+
+    def is_command_channel(self, channel: discord.abc.Messageable) -> bool:
+        """Check whether commands may be used in a channel.
+        @param channel: the channel
+        @return: True if the channel is one of its guild's command channels, False otherwise
+        """
+        guild = getattr(channel, 'guild', None)
+        return guild is not None and channel.id in self.command_channels.get(guild.id, ())
@@ -1,5 +1,7 @@
 # chart.py
 
+from typing import List, NamedTuple
+
 BASE_URL = 'https://phoenix.piugame.com/leaderboard/over_ranking_view.php'
 
 MODE_ABBREV = {
@@ -27,3 +29,32 @@ class Chart():
 
     def get_leaderboard_url(self) -> str:
         return f'{BASE_URL}?no={self.leaderboard_id}'
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Chart':
+        """Create a chart from a row of the songlist.
+        @param data: dict of { field : value }, with the songlist's fields
+        @return: the Chart
+        """
+        return cls(title=data['title'], mode=data['mode'], level=data['level'], leaderboard_id=data['id'], thumbnail_url=data['thumbnail'])
+
+    def get_fields(self) -> tuple:
+        return (self.title, self.mode, self.level, self.leaderboard_id, self.thumbnail_url)
+
+class SonglistChanges(NamedTuple):
+    # chart IDs, lowercase
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+
+def diff_charts(charts: dict[str, Chart], new_charts: dict[str, Chart]) -> SonglistChanges:
+    """Find the charts added to, removed from and changed in a songlist.
+    @param charts: dict of { chart_id : Chart } in the current songlist
+    @param new_charts: dict of { chart_id : Chart } in the new songlist
+    @return: the SonglistChanges
+    """
+    return SonglistChanges(
+        added=[chart_id for chart_id in new_charts if chart_id not in charts],
+        removed=[chart_id for chart_id in charts if chart_id not in new_charts],
+        changed=[chart_id for chart_id, chart in new_charts.items() if chart_id in charts and charts[chart_id].get_fields() != chart.get_fields()],
+    )
@@ -0,0 +1,190 @@
+# chart_search.py
+# Trigram index over chart titles, so that a mistyped chart is matched against a few candidates instead of every chart.
+
+import re
+from collections import Counter
+from typing import List
+
+from fuzzywuzzy import process
+
+from chart import Chart
+
+# common abbreviations in chart queries, as { abbreviation : what it stands for }
+DEFAULT_ALIASES = {
+    'sc': 'short cut',
+    'fs': 'full song',
+    'rmx': 'remix',
+}
+
+# a mode and level hint such as "S22", "d 24", "co-op x3" or "double 24"
+HINT_PATTERN = re.compile(r'\b(s|sp|single|d|dp|double|co-?op)\s*x?(\d{1,2})\b')
+HINT_MODES = {
+    's': 'Single',
+    'sp': 'Single',
+    'single': 'Single',
+    'd': 'Double',
+    'dp': 'Double',
+    'double': 'Double',
+    'coop': 'Co-op',
+    'co-op': 'Co-op',
+}
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+def get_tokens(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def get_trigrams(tokens: List[str]) -> set[str]:
+    """Get the trigrams of each token, padded so that short tokens and token boundaries count too.
+    @param tokens: the lowercase tokens
+    @return: set of trigrams
+    """
+    trigrams = set()
+    for token in tokens:
+        padded = f'  {token} '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    return trigrams
+
+class ChartSearchIndex:
+    # the number of titles whose charts are scored, out of those sharing the most trigrams with the query
+    MAX_CANDIDATE_TITLES = 25
+    # the share of the query's trigrams that a title must have to be a candidate
+    MIN_TRIGRAM_OVERLAP = 0.3
+
+    def __init__(self, aliases: dict[str, str] = None):
+        """Initialize an empty chart search index. It is filled by build.
+        @param aliases: dict of { abbreviation : what it stands for }, in addition to DEFAULT_ALIASES
+        """
+        self.aliases = { **DEFAULT_ALIASES, **{ alias.lower(): title.lower() for alias, title in (aliases or dict()).items() } }
+
+        # chart_ids is list of every chart's ID, lowercase
+        self.chart_ids = []
+        # titles is list of each distinct chart title, lowercase
+        self.titles = []
+        # charts_by_title is list of { chart_id : Chart }, for each title in titles
+        self.charts_by_title = []
+        # titles_by_trigram is dict of { trigram : list of indexes into titles }
+        self.titles_by_trigram = dict()
+
+    def build(self, charts: dict[str, Chart]):
+        """Rebuild the index from the songlist.
+        @param charts: dict of { chart_id : Chart }
+        @return: None
+        """
+        title_indexes = dict()
+        self.chart_ids = list(charts.keys())
+        self.titles = []
+        self.charts_by_title = []
+        self.titles_by_trigram = dict()
+
+        for chart_id, chart in charts.items():
+            title = chart.title.strip().lower()
+            if title not in title_indexes:
+                title_indexes[title] = len(self.titles)
+                self.titles.append(title)
+                self.charts_by_title.append(dict())
+
+                for trigram in get_trigrams(get_tokens(title)):
+                    self.titles_by_trigram.setdefault(trigram, []).append(title_indexes[title])
+
+            self.charts_by_title[title_indexes[title]][chart_id] = chart
+
+    def parse_query(self, query: str) -> tuple[str, str, str]:
+        """Split a chart query into its title and its mode and level hint, expanding any aliases.
+        @param query: the chart query, e.g. "ghroth sc d24"
+        @return: (title, mode, level), where mode and level are None without a hint
+        """
+        query = query.lower()
+        mode = level = None
+
+        # the last hint wins, as chart IDs end with the mode and level
+        hints = list(HINT_PATTERN.finditer(query))
+        if len(hints) > 0:
+            hint = hints[-1]
+            mode = HINT_MODES[hint.group(1)]
+            # co-op levels are player counts, listed as e.g. "x3"
+            level = f'x{int(hint.group(2))}' if mode == 'Co-op' else str(int(hint.group(2)))
+            query = query[:hint.start()] + query[hint.end():]
+
+        title = query.strip()
+        if title in self.aliases:
+            title = self.aliases[title]
+        else:
+            title = ' '.join(self.aliases.get(token, token) for token in get_tokens(title))
+
+        return title, mode, level
+
+    def get_candidates(self, title: str) -> List[int]:
+        """Get the titles that share enough trigrams with a queried title to be scored.
+        @param title: the queried title
+        @return: list of indexes into titles, or None if the title is too short to narrow the search
+        """
+        trigrams = get_trigrams(get_tokens(title))
+        if len(trigrams) == 0:
+            return None
+
+        overlaps = Counter()
+        for trigram in trigrams:
+            overlaps.update(self.titles_by_trigram.get(trigram, ()))
+
+        min_overlap = len(trigrams) * self.MIN_TRIGRAM_OVERLAP
+        return [index for index, overlap in overlaps.most_common(self.MAX_CANDIDATE_TITLES) if overlap >= min_overlap]
+
+    def search(self, query: str, score_cutoff: int = 60, limit: int = 10) -> List[tuple[str, int]]:
+        """Find the charts best matching a query, among the titles sharing enough trigrams with it.
+        @param query: the chart query, e.g. "ghroth sc d24"
+        @param score_cutoff: the minimum fuzzy match score, out of 100
+        @param limit: the maximum number of matches
+        @return: list of (chart_id, score), best match first, or an empty list if only search_all could find any
+        """
+        title, mode, level = self.parse_query(query)
+        query = query.strip().lower()
+
+        if len(title) == 0:
+            # a bare hint such as "S22" identifies its charts by itself
+            if mode is None:
+                return []
+            chart_ids = sorted((chart_id for charts in self.charts_by_title for chart_id, chart in charts.items() if chart.mode == mode and chart.level == level),
+                               key=str.strip)
+            return [(chart_id, 100) for chart_id in chart_ids[:limit]]
+
+        candidates = self.get_candidates(title)
+        if candidates is None:
+            candidates = range(len(self.titles))
+
+        if mode is not None:
+            # the hint already matched the chart's mode and level, so only the title is scored
+            choices = { chart_id: self.titles[index]
+                        for index in candidates for chart_id, chart in self.charts_by_title[index].items()
+                        if chart.mode == mode and chart.level == level }
+            matches = self.score_choices(title, choices, score_cutoff, limit)
+            if len(matches) > 0:
+                return matches
+
+        # the hint may be mistyped, so the candidates of every mode and level are scored against the whole query
+        choices = { chart_id: chart_id for index in candidates for chart_id in self.charts_by_title[index] }
+        return self.score_choices(query, choices, score_cutoff, limit)
+
+    def search_all(self, query: str, score_cutoff: int = 60, limit: int = 10) -> List[tuple[str, int]]:
+        """Find the charts best matching a query by scoring every chart ID, for titles that share too few trigrams with the query to be found
+        by search, e.g. short or numeric titles with swapped characters. This is as slow as the index is fast, so it should run in a worker thread.
+        @param query: the chart query, e.g. "1498 s21"
+        @param score_cutoff: the minimum fuzzy match score, out of 100
+        @param limit: the maximum number of matches
+        @return: list of (chart_id, score), best match first
+        """
+        return self.score_choices(query.strip().lower(), { chart_id: chart_id for chart_id in self.chart_ids }, score_cutoff, limit)
+
+    def score_choices(self, query: str, choices: dict[str, str], score_cutoff: int, limit: int) -> List[tuple[str, int]]:
+        """Score choices against a query with fuzzywuzzy.
+        @param query: the query
+        @param choices: dict of { chart_id : the text the query is scored against }
+        @param score_cutoff: the minimum fuzzy match score, out of 100
+        @param limit: the maximum number of matches
+        @return: list of (chart_id, score), best match first
+        """
+        if len(query) == 0 or len(choices) == 0:
+            return []
+
+        return [(chart_id, match_score) for _, match_score, chart_id in process.extractBests(query, choices, score_cutoff=score_cutoff, limit=limit)]
@@ -0,0 +1,131 @@
+# crawl_engine.py
+# A long-lived Scrapy crawl engine that runs crawl jobs submitted from the bot's event loop.
+
+import asyncio
+import logging
+
+from crochet import setup, run_in_reactor
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.project import get_project_settings
+
+setup()
+
+logger = logging.getLogger('discord')
+
+class CrawlJob:
+    def __init__(self, spider_cls: type, kwargs: dict, future: asyncio.Future):
+        """Initialize a crawl job.
+        @param spider_cls: the spider to crawl with
+        @param kwargs: the arguments to create the spider with
+        @param future: the future to resolve once the crawl finishes
+        """
+        self.spider_cls = spider_cls
+        self.kwargs = kwargs
+        self.future = future
+
+class CrawlEngine:
+    def __init__(self, num_workers: int = 4):
+        """Initialize the crawl engine. The engine must be started from the event loop before submitting jobs.
+        @param num_workers: the number of jobs that may crawl at the same time
+        """
+        self.num_workers = num_workers
+        self.settings = get_project_settings()
+
+        # the runner is created on first use, in the reactor thread
+        self.runner = None
+
+        self.loop = None
+        self.queue = None
+        self.workers = []
+
+    async def start(self):
+        """Start the engine's workers on the running event loop.
+        @return: None
+        """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.workers = [self.loop.create_task(self.work()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        """Stop the engine's workers and any running crawls.
+        @return: None
+        """
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+        if self.runner is not None:
+            future = self.loop.create_future()
+            self.stop_runner(future)
+            await future
+
+    def submit(self, spider_cls: type, **kwargs) -> asyncio.Future:
+        """Queue a crawl job.
+        @param spider_cls: the spider to crawl with
+        @param kwargs: the arguments to create the spider with
+        @return: a future that resolves once the crawl finishes
+        """
+        future = self.loop.create_future()
+        self.queue.put_nowait(CrawlJob(spider_cls, kwargs, future))
+        return future
+
+    async def work(self):
+        """Run queued crawl jobs, one at a time.
+        @return: None
+        """
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.crawl(job.spider_cls, job.kwargs)
+                if not job.future.done():
+                    job.future.set_result(None)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                logger.exception(f'Crawl with {job.spider_cls.__name__} failed')
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    def crawl(self, spider_cls: type, kwargs: dict) -> asyncio.Future:
+        """Start a crawl in the reactor thread.
+        @param spider_cls: the spider to crawl with
+        @param kwargs: the arguments to create the spider with
+        @return: a future that resolves once the crawl finishes
+        """
+        future = self.loop.create_future()
+        self.start_crawl(spider_cls, kwargs, future)
+        return future
+
+    @run_in_reactor
+    def start_crawl(self, spider_cls: type, kwargs: dict, future: asyncio.Future):
+        try:
+            if self.runner is None:
+                self.runner = CrawlerRunner(self.settings)
+
+            d = self.runner.crawl(spider_cls, **kwargs)
+        except Exception as e:
+            self.loop.call_soon_threadsafe(self.resolve, future, e)
+            return
+
+        d.addCallbacks(
+            lambda _: self.loop.call_soon_threadsafe(self.resolve, future, None),
+            lambda failure: self.loop.call_soon_threadsafe(self.resolve, future, failure.value),
+        )
+
+    @run_in_reactor
+    def stop_runner(self, future: asyncio.Future):
+        d = self.runner.stop()
+        d.addBoth(lambda _: self.loop.call_soon_threadsafe(self.resolve, future, None))
+
+    def resolve(self, future: asyncio.Future, exception: BaseException):
+        if future.done():
+            return
+
+        if exception is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exception)
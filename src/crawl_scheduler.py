@@ -0,0 +1,62 @@
+# crawl_scheduler.py
+# Picks which charts to crawl each update cycle, favouring charts that change often or have tracked players on them.
+
+import heapq
+from typing import Iterable, List, Set
+
+class CrawlScheduler:
+    def __init__(self, budget: int, change_weight: float = 4.0, tracked_weight: float = 3.0, smoothing: float = 0.3):
+        """Initialize the crawl scheduler.
+        @param budget: the number of charts to crawl per update cycle
+        @param change_weight: how much a chart's change rate raises its priority
+        @param tracked_weight: how much having a tracked player on a chart multiplies its priority
+        @param smoothing: how quickly the change rate follows recent crawls, between 0 and 1
+        """
+        self.budget = budget
+        self.change_weight = change_weight
+        self.tracked_weight = tracked_weight
+        self.smoothing = smoothing
+
+        # change_rates is dict of { chart_id : moving average of how often a crawl found changes }
+        self.change_rates = dict()
+
+    def record_crawl(self, chart_id: str, changed: bool):
+        """Record the outcome of crawling a chart.
+        @param chart_id: the chart's ID, lowercase
+        @param changed: whether the crawl found the chart's leaderboard changed
+        @return: None
+        """
+        prev_rate = self.change_rates.get(chart_id, 0.0)
+        self.change_rates[chart_id] = self.smoothing * float(changed) + (1 - self.smoothing) * prev_rate
+
+    def forget(self, chart_id: str):
+        """Drop the crawl history of a chart that no longer exists.
+        @param chart_id: the chart's ID, lowercase
+        @return: None
+        """
+        self.change_rates.pop(chart_id, None)
+
+    def get_priority(self, chart_id: str, age: float, tracked: bool) -> float:
+        """Get a chart's crawl priority. Priority grows with time since the last crawl, so every chart is eventually crawled.
+        @param chart_id: the chart's ID, lowercase
+        @param age: seconds since the chart was last crawled, or None if it never was
+        @param tracked: whether a tracked player is on the chart
+        @return: the chart's priority; higher is crawled sooner
+        """
+        if age is None:
+            return float('inf')
+
+        priority = age * (1 + self.change_weight * self.change_rates.get(chart_id, 0.0))
+        if tracked:
+            priority *= self.tracked_weight
+
+        return priority
+
+    def select(self, chart_ages: Iterable[tuple[str, float]], tracked_charts: Set[str]) -> List[str]:
+        """Select the charts to crawl this cycle.
+        @param chart_ages: (chart_id, seconds since last crawl or None) tuples for every crawlable chart
+        @param tracked_charts: the IDs of the charts that tracked players are on
+        @return: the IDs of the charts to crawl, highest priority first
+        """
+        priorities = ((self.get_priority(chart_id, age, chart_id in tracked_charts), chart_id) for chart_id, age in chart_ages)
+        return [chart_id for _, chart_id in heapq.nlargest(self.budget, priorities)]
@@ -1,16 +1,25 @@
 # guild_leaderboard.py
 
 import os
+from typing import List
+
 import discord
-from leaderboard import Leaderboard, SAVE_DIR
+from leaderboard import SAVE_DIR
+from outbound_queue import OutboundQueue
+from pumbility import Pumbility
+from score import Score
+from subscription_index import SubscriptionIndex
 
 class GuildLeaderboard:
     PLAYERS_SAVE_FILE = 'players.txt'
 
-    def __init__(self, guild_id: str):
+    def __init__(self, guild_id: str, subscriptions: SubscriptionIndex):
         """ Initialize the guild's leaderboard.
         @param guild_id: the guild's name
+        @param subscriptions: the index of which guilds track which players, shared by all guilds
         """
+        self.guild_id = guild_id
+        self.subscriptions = subscriptions
         self.players = set()
         self.players_file = os.path.join(SAVE_DIR, f'{guild_id}_{self.PLAYERS_SAVE_FILE}')
         if os.path.isfile(self.players_file):
@@ -18,6 +27,9 @@ class GuildLeaderboard:
                 for line in f:
                     self.players.add(line.strip().upper())
 
+        for player in self.players:
+            self.subscriptions.subscribe(self.guild_id, player)
+
     async def add_player(self, player_id: str) -> bool:
         """ Add a player to the guild's leaderboard. If the player is already being tracked, do nothing.
         Players that are being tracked will have their leaderboard updates automatically sent to the guild's 'piu-leaderboard' channel.
@@ -28,6 +40,7 @@ class GuildLeaderboard:
         added = player_id not in self.players
         if added:
             self.players.add(player_id)
+            self.subscriptions.subscribe(self.guild_id, player_id)
 
         await self.save()
         return added
@@ -45,27 +58,31 @@ class GuildLeaderboard:
         for player in self.players.copy():
             if player.startswith(player_id):
                 self.players.remove(player)
+                self.subscriptions.unsubscribe(self.guild_id, player)
                 removed = True
 
         await self.save()
         return removed
 
-    async def get_leaderboard_updates(self, leaderboard: Leaderboard, channel: discord.TextChannel):
-        """ Get the leaderboard updates for all the players being tracked in the guild.
+    async def get_leaderboard_updates(self, score_updates: List[tuple[Score, Score]], channel: discord.TextChannel, outbound: OutboundQueue):
+        """ Queue the leaderboard updates for the players being tracked in the guild.
+        @param score_updates: the guild's (new_score, prev_score) tuples, as routed by the subscription index
         @param channel: the channel to send the updates to
+        @param outbound: the queue to send the updates through
         @return: None
         """
-        for (new_score, prev_score) in await leaderboard.get_score_updates(self.players):
-            embed, f = await new_score.embed(prev_score=prev_score, compare=True)
-            await channel.send(embed=embed, file=f)
+        for (new_score, prev_score) in score_updates:
+            outbound.enqueue(channel, await new_score.make_embed(prev_score=prev_score, compare=True), new_score.get_icon())
 
-    async def get_pumbility_updates(self, leaderboard: Leaderboard, channel: discord.TextChannel):
-        """ Get the pumbility updates for all the players being tracked in the guild.
+    async def get_pumbility_updates(self, pumbility_updates: List[tuple[Pumbility, Pumbility]], channel: discord.TextChannel, outbound: OutboundQueue):
+        """ Queue the pumbility updates for the players being tracked in the guild.
+        @param pumbility_updates: the guild's (new_pumbility, prev_pumbility) tuples, as routed by the subscription index
         @param channel: the channel to send the updates to
+        @param outbound: the queue to send the updates through
         @return: None
         """
-        for (new_pumbility, prev_pumbility) in await leaderboard.get_pumbility_updates(self.players):
-            await channel.send(embed=await new_pumbility.embed(prev_pumbility=prev_pumbility, compare=True))
+        for (new_pumbility, prev_pumbility) in pumbility_updates:
+            outbound.enqueue(channel, await new_pumbility.embed(prev_pumbility=prev_pumbility, compare=True))
 
     async def save(self):
         with open(self.players_file, 'w', encoding='utf-8') as f:
@@ -0,0 +1,108 @@
+# http_engine.py
+# An asyncio-native crawl engine that fetches pages on the bot's own event loop and feeds them to the Scrapy spiders' parse callbacks.
+
+import asyncio
+import logging
+from typing import Iterable
+
+import aiohttp
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+logger = logging.getLogger('discord')
+
+RETRY_STATUSES = set([429, 500, 502, 503, 504])
+
+class HttpEngine:
+    def __init__(self, max_concurrency: int = 8, max_retries: int = 3, backoff: float = 1.0, timeout: float = 30.0):
+        """Initialize the HTTP crawl engine. The engine must be started from the event loop before submitting jobs.
+        @param max_concurrency: the maximum number of requests in flight at once
+        @param max_retries: the number of times a failed request is retried
+        @param backoff: seconds to wait before the first retry; doubled for each retry after that
+        @param timeout: seconds before a request times out
+        """
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = None
+        self.semaphore = None
+
+    async def start(self):
+        """Open the engine's pooled HTTP session on the running event loop.
+        @return: None
+        """
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def stop(self):
+        """Close the engine's HTTP session.
+        @return: None
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def submit(self, spider_cls: type, **kwargs) -> asyncio.Future:
+        """Start a crawl job.
+        @param spider_cls: the spider whose start URLs and parse callback to crawl with
+        @param kwargs: the arguments to create the spider with
+        @return: a future that resolves once the crawl finishes
+        """
+        return asyncio.ensure_future(self.crawl(spider_cls(**kwargs)))
+
+    async def crawl(self, spider):
+        """Crawl a spider's start requests, and any requests its callbacks yield.
+        @param spider: the spider to crawl with
+        @return: None
+        """
+        await asyncio.gather(*[self.process(request, request.callback or spider.parse) for request in spider.start_requests()])
+
+    async def process(self, request: Request, callback):
+        """Fetch a request and run its callback on the response.
+        @param request: the request to fetch
+        @param callback: the spider callback to parse the response with
+        @return: None
+        """
+        response = await self.fetch(request)
+        if response is None:
+            return
+
+        results = callback(response)
+        if isinstance(results, Iterable):
+            follow_ups = [self.process(result, result.callback or callback) for result in results if isinstance(result, Request)]
+            await asyncio.gather(*follow_ups)
+
+    async def fetch(self, request: Request) -> HtmlResponse:
+        """Fetch a page, retrying with exponential backoff on errors.
+        @param request: the request to fetch
+        @return: the response, or None if the page could not be fetched
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                async with self.semaphore:
+                    async with self.session.get(request.url, headers=request.headers.to_unicode_dict()) as resp:
+                        body = await resp.read()
+
+                        if resp.status in RETRY_STATUSES:
+                            logger.warning(f'Got status {resp.status} for {request.url} (attempt {attempt + 1})')
+                            continue
+                        if resp.status != 200 and resp.status not in request.meta.get('handle_httpstatus_list', ()):
+                            logger.warning(f'Got status {resp.status} for {request.url}, skipping')
+                            return None
+
+                        # keep the original request so that callbacks can look pages up by the URL they asked for
+                        return HtmlResponse(url=str(resp.url), status=resp.status, headers=dict(resp.headers), body=body,
+                                            encoding=resp.charset or 'utf-8', request=request)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f'Failed to fetch {request.url} (attempt {attempt + 1}): {e!r}')
+
+        logger.error(f'Giving up on {request.url} after {self.max_retries + 1} attempts')
+        return None
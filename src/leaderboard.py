@@ -1,125 +1,378 @@
 # leaderboard.py
 
 import asyncio
-import concurrent.futures
 import csv
+from collections import Counter
 import json
+import logging
+import math
 import os
-from typing import List, Set
+import time
+from typing import Iterable, List, Set
 
-from crochet import setup, wait_for
-from fuzzywuzzy import process
 from discord.ext import commands
-from scrapy.crawler import CrawlerRunner
-from scrapy.utils.project import get_project_settings
 
-from chart import Chart
+from chart import Chart, SonglistChanges, diff_charts
+from chart_search import ChartSearchIndex
+from crawl_engine import CrawlEngine
+from crawl_scheduler import CrawlScheduler
+from http_engine import HttpEngine
 from score import Score
 from leaderboard_crawler import LeaderboardCrawler
+from leaderboard_diff import SCORE_UPDATE_KINDS, ChangeStream, get_score_updates
+from leaderboard_snapshot import Snapshot, SnapshotError, SnapshotRow, SnapshotSection, encode_snapshot
+from leaderboard_store import LeaderboardStore
+from player_index import PlayerIndex
+from prefix_trie import PrefixTrie
 from pumbility import Pumbility
 from pumbility_crawler import PumbilityCrawler
+from songlist_crawler import SonglistCrawler, serialize_songlist, sort_songlist
+from ranking_dict import RankingDict
+from score_history import PUMBILITY_KEY, HistoryRecord, ScoreHistory
+from single_flight import SingleFlight
+from write_behind import WriteBehindWriter
 
-setup()
+logger = logging.getLogger('discord')
 
 SAVE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
-MODES = [
-    'Single',
-    'Double',
-    'Co-op',
-]
+CRAWL_ENGINES = {
+    'scrapy': CrawlEngine,
+    'aiohttp': HttpEngine,
+}
 
 class Leaderboard:
     LEADERBOARD_SAVE_FILE = os.path.join(SAVE_DIR, 'leaderboard.json')
+    LEADERBOARD_STORE_DIR = os.path.join(SAVE_DIR, 'leaderboard')
     PUMBILITY_SAVE_FILE = os.path.join(SAVE_DIR, 'pumbility.json')
+    PUMBILITY_SNAPSHOT_FILE = os.path.join(SAVE_DIR, 'pumbility.snap')
     SONGLIST_SAVE_FILE = os.path.join(SAVE_DIR, 'songlist.csv')
+    CHART_ALIASES_FILE = os.path.join(SAVE_DIR, 'chart_aliases.json')
+    HISTORY_LOG_FILE = os.path.join(SAVE_DIR, 'history.log')
+    HISTORY_INDEX_FILE = os.path.join(SAVE_DIR, 'history.idx')
+
+    PUMBILITY_CRAWL_KEY = 'pumbility'
+    SONGLIST_CRAWL_KEY = 'songlist'
+    # the share of the current charts a crawled songlist must have to replace the current one
+    MIN_SONGLIST_RATIO = 0.9
+    PUMBILITY_SECTION = 'pumbility'
 
     def __init__(self):
         """Initialize the master leaderboard."""
+        # seconds a chart's leaderboard may go without a crawl before queries rescrape it
+        self.max_staleness = float(os.getenv('CHART_MAX_STALENESS', 300))
+        # whether queries on stale charts answer immediately and refresh the chart in the background
+        self.stale_while_revalidate = os.getenv('CHART_STALE_WHILE_REVALIDATE', 'false').lower() == 'true'
+        self.background_refreshes = set()
+        # seconds between songlist refreshes
+        self.songlist_refresh_interval = float(os.getenv('SONGLIST_REFRESH_HOURS', 24)) * 3600
+
+        # chart aliases is dict of { abbreviation : what it stands for }, for chart queries
+        chart_aliases = dict()
+        if os.path.isfile(self.CHART_ALIASES_FILE):
+            with open(self.CHART_ALIASES_FILE, 'r', encoding='utf-8') as f:
+                chart_aliases = json.load(f)
+        self.chart_search = ChartSearchIndex(chart_aliases)
+        # completions of chart IDs, and of every known player ID once one is first completed
+        self.chart_trie = PrefixTrie()
+        self.player_trie = None
+
         # chart is dict of { chart_id : Chart }
         self.charts = dict()
-        if os.path.isfile(self.SONGLIST_SAVE_FILE):
-            with open(self.SONGLIST_SAVE_FILE, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    chart = Chart(title=row['title'], mode=row['mode'], level=row['level'], leaderboard_id=row['id'], thumbnail_url=row['thumbnail'])
-                    self.charts[chart.chart_id.lower()] = chart
-
-        # split chart ids into 3 batches to reduce the number of requests per batch
-        self.curr_mode_idx = 0
-
-        # scores is dict of { chart_id : dict of { player_id : Score } }
-        if os.path.isfile(self.LEADERBOARD_SAVE_FILE):
+        self.load_songlist()
+
+        # crawl a third of the charts per update cycle by default, to limit the number of requests per cycle
+        self.crawl_scheduler = CrawlScheduler(self.get_crawl_budget())
+        # counts of all crawled chart pages that were parsed, or skipped as unchanged or not modified
+        self.crawl_stats = Counter()
+
+        self.store = LeaderboardStore(self.LEADERBOARD_STORE_DIR)
+        # number of per-chart files saved since the last snapshot, above which they are compacted at startup
+        self.compact_threshold = int(os.getenv('LEADERBOARD_COMPACT_THRESHOLD', 500))
+        # ids of the charts whose leaderboards changed since the last save
+        self.updated_charts = set()
+        # whether the snapshot holds charts that were removed from the songlist
+        self.has_removed_charts = False
+
+        if self.store.is_empty() and os.path.isfile(self.LEADERBOARD_SAVE_FILE):
+            # migrate from the single-file format
             with open(self.LEADERBOARD_SAVE_FILE, 'r', encoding='utf-8') as f:
-                self.scores = {
-                    chart_id: { 
+                legacy_scores = {
+                    chart_id: RankingDict({ 
                         player_id: Score.from_dict(score, self.charts[chart_id] if chart_id in self.charts else None)
                         for player_id, score in chart_scores.items() 
-                    }
+                    })
                     for chart_id, chart_scores in json.load(f).items()
                 }
-        else :
-            self.scores = dict()
+            self.store.save_charts(legacy_scores, legacy_scores.keys())
 
-        if os.path.isfile(self.PUMBILITY_SAVE_FILE):
-            with open(self.PUMBILITY_SAVE_FILE, 'r', encoding='utf-8') as f:
-                self.pumbility_ranking = {
-                    player_id: Pumbility.from_dict(pumbility)
-                    for player_id, pumbility in json.load(f).items()
-                }
-        else:
-            self.pumbility_ranking = dict()
+        load_start = time.perf_counter()
+
+        # scores is LazyScores of { chart_id : RankingDict of { player_id : Score } }; each chart's Scores are created on first access
+        self.scores = self.store.load(self.charts)
+
+        self.player_index = PlayerIndex(load_chart=self.scores.get)
+        for chart_id in self.scores.keys():
+            self.player_index.add_chart_players(chart_id, self.scores.get_player_ids(chart_id))
+        self.scores.on_hydrate = self.index_hydrated_chart
+
+        logger.info(f'Loaded {len(self.scores)} chart leaderboards in {time.perf_counter() - load_start:.2f}s')
+
+        if len(self.store.get_chart_files()) > self.compact_threshold:
+            self.store.compact(self.scores)
+
+        self.pumbility_ranking = self.load_pumbility_leaderboard()
+
+        # change events found by chart crawls, read by the score update notifications
+        self.change_stream = ChangeStream()
+        self.score_updates_seq = 0
 
+        # every score and Pumbility change, appended from the change stream and the Pumbility crawls
+        self.history = ScoreHistory(self.HISTORY_LOG_FILE, self.HISTORY_INDEX_FILE, int(os.getenv('HISTORY_COMPACT_THRESHOLD', 50000)))
+        self.history.load()
+        self.history_seq = 0
+
+        # updates from the last published update cycle, and Pumbility updates found by crawls since then
         self.score_updates = []
         self.pumbility_updates = []
+        self.new_pumbility_updates = []
+
+        self.writer = WriteBehindWriter()
+
+        # concurrent crawls of the same chart, or of the Pumbility ranking, share a single run
+        self.crawl_flights = SingleFlight()
+
+        # crawl with Scrapy's reactor, or with aiohttp on the bot's own event loop
+        self.crawl_backend = os.getenv('CRAWL_BACKEND', 'scrapy').lower()
+        if self.crawl_backend not in CRAWL_ENGINES:
+            raise ValueError(f'Unknown CRAWL_BACKEND "{self.crawl_backend}", expected one of {", ".join(CRAWL_ENGINES)}')
+        self.crawl_engine = CRAWL_ENGINES[self.crawl_backend]()
+
+    def load_songlist(self):
+        """ Load the charts from the saved songlist, and build the chart search indexes for them.
+        @return: None
+        """
+        if os.path.isfile(self.SONGLIST_SAVE_FILE):
+            with open(self.SONGLIST_SAVE_FILE, 'r', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    chart = Chart.from_dict(row)
+                    self.charts[chart.chart_id.lower()] = chart
+
+        self.build_chart_indexes()
+
+    def build_chart_indexes(self):
+        """ Rebuild the chart search index and the chart completions from the current charts.
+        @return: None
+        """
+        self.chart_search.build(self.charts)
+
+        self.chart_trie.clear()
+        for chart_id, chart in self.charts.items():
+            self.chart_trie.insert_words(chart.chart_id, chart_id)
+
+    def is_songlist_fresh(self) -> bool:
+        """ Check whether the songlist was saved recently enough to skip refreshing it.
+        @return: True if the songlist was saved within the songlist refresh interval, False otherwise
+        """
+        if not os.path.isfile(self.SONGLIST_SAVE_FILE):
+            return False
+
+        return time.time() - os.path.getmtime(self.SONGLIST_SAVE_FILE) <= self.songlist_refresh_interval
+
+    async def refresh_songlist(self) -> SonglistChanges:
+        """ Recrawl the songlist, and apply the charts added, removed and changed since the last one to the running leaderboard.
+        @return: the SonglistChanges, or None if the songlist could not be crawled
+        """
+        return await self.crawl_flights.run(self.SONGLIST_CRAWL_KEY, self.crawl_songlist)
+
+    async def crawl_songlist(self) -> SonglistChanges:
+        """ Crawl every page of the songlist at once with the crawl engine, and apply the changes.
+        @return: the SonglistChanges, or None if the songlist could not be crawled
+        """
+        songlist = []
+        start_time = time.perf_counter()
+        await self.crawl_engine.submit(SonglistCrawler, songlist=songlist)
+        songlist = sort_songlist(songlist)
+
+        # a failed crawl would otherwise remove every chart it missed
+        if len(songlist) < len(self.charts) * self.MIN_SONGLIST_RATIO:
+            logger.warning(f'Crawled only {len(songlist)} of {len(self.charts)} charts in the songlist, keeping the current songlist')
+            return None
+
+        new_charts = dict()
+        for row in songlist:
+            chart = Chart.from_dict(row)
+            new_charts[chart.chart_id.lower()] = chart
+
+        changes = diff_charts(self.charts, new_charts)
+        self.apply_songlist_changes(new_charts, changes)
+
+        self.writer.schedule(self.SONGLIST_SAVE_FILE, songlist, serialize=serialize_songlist)
+
+        logger.info(f'Refreshed the songlist in {time.perf_counter() - start_time:.2f}s: {len(changes.added)} charts added, '
+                    f'{len(changes.removed)} removed, {len(changes.changed)} changed')
+
+        return changes
+
+    def apply_songlist_changes(self, new_charts: dict[str, Chart], changes: SonglistChanges):
+        """ Apply songlist changes to the charts, their leaderboards and every index over them.
+        @param new_charts: dict of { chart_id : Chart } in the new songlist
+        @param changes: the changes from the current charts to new_charts
+        @return: None
+        """
+        for chart_id in changes.removed:
+            self.remove_chart_scores(chart_id)
+            # a pending save would write the removed chart's file again
+            self.writer.cancel(self.store.get_chart_file(chart_id))
+            self.store.remove_chart(chart_id)
+            self.updated_charts.discard(chart_id)
+            self.crawl_scheduler.forget(chart_id)
+            del self.charts[chart_id]
+            self.has_removed_charts = True
+
+        for chart_id in changes.changed:
+            chart = new_charts[chart_id]
+            self.charts[chart_id] = chart
+
+            # the loaded scores refer to their chart, e.g. for its thumbnail; the rest get the new chart when loaded
+            if self.scores.is_hydrated(chart_id):
+                for score in self.scores[chart_id].values():
+                    score.chart = chart
+
+        for chart_id in changes.added:
+            self.charts[chart_id] = new_charts[chart_id]
+
+        if len(changes.added) > 0 or len(changes.removed) > 0:
+            # the default budget is a share of the songlist
+            self.crawl_scheduler.budget = self.get_crawl_budget()
+
+        if len(changes.added) > 0 or len(changes.removed) > 0 or len(changes.changed) > 0:
+            self.build_chart_indexes()
+
+    def get_crawl_budget(self) -> int:
+        """ Get the number of charts to crawl per update cycle, from CRAWL_BUDGET or else a third of the charts.
+        @return: the crawl budget
+        """
+        return int(os.getenv('CRAWL_BUDGET', math.ceil(len(self.charts) / 3)))
+
+    def remove_chart_scores(self, chart_id: str):
+        """ Remove a chart's leaderboard, and its players' entries for it from the player index.
+        @param chart_id: the chart's ID, lowercase
+        @return: None
+        """
+        for player_id in list(self.scores.get_player_ids(chart_id)):
+            self.player_index.remove(player_id, chart_id)
+
+        self.scores.pop(chart_id)
+
+    def index_hydrated_chart(self, chart_id: str, chart_scores: RankingDict):
+        """ Replace the player index's placeholder entries for a chart with its Scores, once they are created.
+        @param chart_id: the chart's ID, lowercase
+        @param chart_scores: the chart's RankingDict
+        @return: None
+        """
+        self.player_index.update_chart(chart_id, None, chart_scores)
+
+    async def start(self):
+        """ Start the crawl engine. Must be called from the event loop before any crawls.
+        @return: None
+        """
+        await self.crawl_engine.start()
+
+    async def close(self):
+        """ Stop the crawl engine, wait until all scheduled saves have been written, and compact the saved chart leaderboards.
+        @return: None
+        """
+        await self.crawl_engine.stop()
+        await self.flush()
+        await asyncio.to_thread(self.history.close)
+
+        # nothing is being written anymore, so the per-chart files can be folded into the snapshot, and removed charts dropped from it;
+        # unchanged charts are only saved here, with the crawl times and validators of their latest crawls
+        if len(self.store.get_chart_files()) > 0 or self.has_removed_charts or sum(self.crawl_stats.values()) > 0:
+            await asyncio.to_thread(self.store.compact, self.scores)
 
     async def update_chart(self, chart_id: str) -> bool:
         """ Update the leaderboard for a given chart.
         @param chart_id: the chart's ID, lowercase
         @return: None
         """
-        urls = {}
-        if chart_id is not None and chart_id in self.charts:
-            chart = self.charts[chart_id]
-            urls[chart.get_leaderboard_url()] = chart
-        else:
+        if chart_id is None or chart_id not in self.charts:
             return False
 
-        await self.crawl_charts_in_thread(urls)
-        await self.save_chart_leaderboards()
+        await self.crawl_flights.run(chart_id, self.crawl_chart, self.charts[chart_id])
 
         return True
 
-    async def update_all_charts(self):
-        """ Update all chart leaderboards.
+    async def crawl_chart(self, chart: Chart):
+        """ Crawl and save the leaderboard for a single chart.
+        @param chart: the chart to crawl
         @return: None
         """
-        curr_mode = MODES[self.curr_mode_idx]
-        self.curr_mode_idx = (self.curr_mode_idx + 1) % len(MODES)
-
-        urls = { chart.get_leaderboard_url() : chart for chart in self.charts.values() if chart.mode == curr_mode }
-
-        await self.crawl_charts_in_thread(urls)
+        await self.crawl_charts({ chart.get_leaderboard_url() : chart })
         await self.save_chart_leaderboards()
 
-    async def crawl_charts_in_thread(self, urls: dict[str, Chart]):
-        """ Run the leaderboard crawler in a thread.
-        @param urls: dict of { url : Chart }
+    async def update_all_charts(self, tracked_players: Set[str] = None):
+        """ Update the chart leaderboards most in need of a crawl, as picked by the crawl scheduler.
+        @param tracked_players: the IDs of the players tracked by any guild, whose charts are crawled more often
         @return: None
         """
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = loop.run_in_executor(executor, self.run_crawl_charts, urls)
-            await future
+        now = time.time()
+        chart_ages = [(chart_id, now - last_crawled if (last_crawled := self.scores.get_last_crawled(chart_id)) is not None else None)
+                      for chart_id in self.charts]
+
+        tracked_charts = set()
+        for player_id in tracked_players or ():
+            tracked_charts.update(self.player_index.find_charts(player_id))
 
-    @wait_for(timeout=600.0)
-    def run_crawl_charts(self, urls):
-        self.score_updates.clear()
+        urls = { self.charts[chart_id].get_leaderboard_url() : self.charts[chart_id]
+                 for chart_id in self.crawl_scheduler.select(chart_ages, tracked_charts) }
 
-        runner = CrawlerRunner(get_project_settings())
-        runner.crawl(LeaderboardCrawler, leaderboard_urls=urls, scores=self.scores, score_updates=self.score_updates)
-        d = runner.join()  # returns a Deferred that fires when all crawling jobs have finished
-        return d
+        start_time = time.perf_counter()
+        crawl_stats = await self.crawl_charts(urls)
+        logger.info(f'Crawled {len(urls)} charts with the {self.crawl_backend} backend in {time.perf_counter() - start_time:.2f}s '
+                    f'({crawl_stats["parsed"]} parsed, {crawl_stats["unchanged"]} unchanged, {crawl_stats["not_modified"]} not modified)')
+
+        await self.save_chart_leaderboards()
+
+        if self.history.should_compact():
+            await asyncio.to_thread(self.history.compact)
+
+    async def crawl_charts(self, urls: dict[str, Chart]) -> Counter:
+        """ Crawl chart leaderboards with the crawl engine.
+        Each crawl collects its results separately, and they are merged in once it finishes.
+        @param urls: dict of { url : Chart }
+        @return: counts of the crawled pages that were parsed, unchanged or not modified
+        """
+        change_events = []
+        updated_charts = set()
+        crawl_stats = Counter()
+        start_time = time.time()
+
+        await self.crawl_engine.submit(LeaderboardCrawler, leaderboard_urls=urls, scores=self.scores, change_events=change_events,
+                                       updated_charts=updated_charts, player_index=self.player_index, crawl_stats=crawl_stats)
+
+        # a songlist refresh may have removed charts while they were being crawled, which the crawl then added back
+        removed_charts = set(chart.chart_id.lower() for chart in urls.values()) - self.charts.keys()
+        for chart_id in removed_charts:
+            self.remove_chart_scores(chart_id)
+        updated_charts -= removed_charts
+        change_events = [event for event in change_events if event.chart_id not in removed_charts]
+
+        self.change_stream.publish(change_events)
+        await self.record_score_history()
+        self.updated_charts.update(updated_charts)
+        for chart_id in updated_charts:
+            if chart_id in self.scores:
+                self.add_player_completions(self.scores[chart_id].keys())
+        self.crawl_stats.update(crawl_stats)
+
+        for chart in urls.values():
+            chart_key = chart.chart_id.lower()
+            if chart_key not in removed_charts and (self.scores.get_last_crawled(chart_key) or 0) >= start_time:
+                self.crawl_scheduler.record_crawl(chart_key, chart_key in updated_charts)
+
+        return crawl_stats
 
     async def rescrape_chart(self, bot: commands.Bot, ctx: commands.Context, chart_id: str) -> str:
         """ Rescrape the leaderboard for a given chart.
@@ -128,7 +381,7 @@ class Leaderboard:
         """
         chart_id = chart_id.lower()
         if chart_id in self.charts:
-            if await self.update_chart(chart_id):
+            if await self.refresh_chart(chart_id):
                 return chart_id
         else:
             best_matches = await self.get_best_chart_matches(chart_id)
@@ -142,39 +395,118 @@ class Leaderboard:
                 if message.content.isnumeric() and int(message.content) - 1 < len(best_matches):
                     chart_id = best_matches[int(message.content) - 1][0]
                     async with ctx.typing():
-                        if await self.update_chart(chart_id):
+                        if await self.refresh_chart(chart_id):
                             return chart_id
             except asyncio.TimeoutError:
                 await ctx.send('Sorry, you took too long to respond.')
 
         return None
 
+    async def refresh_chart(self, chart_id: str) -> bool:
+        """ Make sure a chart's leaderboard is fresh enough to be queried, rescraping it if needed.
+        If stale-while-revalidate is enabled, stale leaderboards are served as-is while the chart is rescraped in the background.
+        @param chart_id: the chart's ID, lowercase
+        @return: True if the chart's leaderboard can be queried, False otherwise
+        """
+        if chart_id not in self.charts:
+            return False
+
+        if self.is_chart_fresh(chart_id):
+            return True
+
+        if self.stale_while_revalidate and chart_id in self.scores:
+            task = asyncio.get_running_loop().create_task(self.update_chart(chart_id))
+            self.background_refreshes.add(task)
+            task.add_done_callback(self.finish_background_refresh)
+            return True
+
+        return await self.update_chart(chart_id)
+
+    def finish_background_refresh(self, task: asyncio.Task):
+        """ Forget a finished background refresh, logging its error, as nothing awaits it.
+        @param task: the refresh's task
+        @return: None
+        """
+        self.background_refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Background chart refresh failed', exc_info=task.exception())
+
+    def is_chart_fresh(self, chart_id: str) -> bool:
+        """ Check whether a chart's leaderboard was crawled recently enough to skip rescraping it.
+        @param chart_id: the chart's ID, lowercase
+        @return: True if the chart was crawled within the max staleness, False otherwise
+        """
+        last_crawled = self.scores.get_last_crawled(chart_id)
+        if last_crawled is None:
+            return False
+
+        return time.time() - last_crawled <= self.max_staleness
+
     async def get_best_chart_matches(self, chart_id: str) -> List[tuple[str, int]]:
         """ Get the best matching chart ID for a given chart.
-        @param chart_id: the chart's ID
-        @return: the best matching chart IDs
+        Only the charts whose titles share enough trigrams with the query are scored; see ChartSearchIndex.
+        Every chart is scored only if none of those match, in a worker thread so as not to block the event loop.
+        @param chart_id: the chart's ID, or a query such as "ghroth sc d24"
+        @return: list of (chart_id, score) of the best matching charts
         """
-        return process.extractBests(chart_id, self.charts.keys(), score_cutoff=60, limit=10)
+        matches = self.chart_search.search(chart_id, score_cutoff=60, limit=10)
+        if len(matches) == 0:
+            matches = await asyncio.to_thread(self.chart_search.search_all, chart_id, 60, 10)
 
-    @wait_for(timeout=600.0)
-    def run_crawl_pumbility_ranking(self):
-        """ Update the Pumbility ranking.
+        return matches
+
+    def complete_chart_ids(self, prefix: str, limit: int = 25) -> List[str]:
+        """ Get the chart IDs starting with a prefix, or with a prefix of one of their words onwards.
+        @param prefix: the typed prefix
+        @param limit: the maximum number of chart IDs
+        @return: list of chart IDs, lowercase
         """
-        self.pumbility_updates.clear()
+        return self.chart_trie.complete(prefix.strip(), limit)
 
-        runner = CrawlerRunner(get_project_settings())
-        runner.crawl(PumbilityCrawler, pumbility_ranking=self.pumbility_ranking, pumbility_updates=self.pumbility_updates)
-        d = runner.join()
-        return d
+    def complete_player_ids(self, prefix: str, limit: int = 25) -> List[str]:
+        """ Get the known player IDs starting with a prefix, from the chart and Pumbility leaderboards.
+        @param prefix: the typed prefix
+        @param limit: the maximum number of player IDs
+        @return: list of player IDs
+        """
+        if self.player_trie is None:
+            # built on first use, as it holds every player and is not needed to start up
+            self.player_trie = PrefixTrie()
+            # snapshots of the players, as crawls update them from other threads while the trie is built
+            self.add_player_completions(list(self.player_index.scores_by_player))
+            self.add_player_completions(list(self.pumbility_ranking))
+
+        return self.player_trie.complete(prefix.strip(), limit)
+
+    def add_player_completions(self, player_ids: Iterable[str]):
+        """ Add player IDs to the player completions, if they have been built.
+        @param player_ids: the player IDs
+        @return: None
+        """
+        if self.player_trie is not None:
+            for player_id in player_ids:
+                self.player_trie.insert(player_id)
 
     async def update_pumbility(self):
         """ Update the Pumbility ranking.
         @return: None
         """
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = loop.run_in_executor(executor, self.run_crawl_pumbility_ranking)
-            await future
+        await self.crawl_flights.run(self.PUMBILITY_CRAWL_KEY, self.crawl_pumbility)
+
+    async def crawl_pumbility(self):
+        """ Crawl the Pumbility ranking with the crawl engine.
+        @return: None
+        """
+        pumbility_updates = []
+
+        await self.crawl_engine.submit(PumbilityCrawler, pumbility_ranking=self.pumbility_ranking, pumbility_updates=pumbility_updates)
+
+        self.new_pumbility_updates.extend(pumbility_updates)
+        self.add_player_completions(self.pumbility_ranking.keys())
+
+        now = time.time()
+        records = [HistoryRecord(PUMBILITY_KEY, pumbility.player_id, now, pumbility.pumbility, pumbility.rank) for pumbility, _ in pumbility_updates]
+        await asyncio.to_thread(self.history.append, records)
 
     async def query_pumbility(self, player_ids: List[str]) -> List[Pumbility]:
         """ Query a player's Pumbility ranking.
@@ -184,8 +516,7 @@ class Leaderboard:
         pumbilities = []
 
         for player_id in player_ids:
-            pumbilities.extend([value for key, value in self.pumbility_ranking.items() if
-                                player_id.upper() == (key if '#' in player_id else key.split('#')[0])])
+            pumbilities.extend(self.pumbility_ranking.find(player_id))
 
         # sort pumbilities by rank
         pumbilities.sort(key=lambda pumbility: pumbility.rank)
@@ -203,8 +534,7 @@ class Leaderboard:
         if chart_id in self.scores:
             scores = []
             for player_id in player_ids:
-                scores.extend([value for key, value in self.scores[chart_id].items() if
-                               player_id.upper() == (key if '#' in player_id else key.split('#')[0])])
+                scores.extend(self.scores[chart_id].find(player_id))
 
             # sort scores by rank
             scores.sort(key=lambda score: score.rank)
@@ -213,85 +543,176 @@ class Leaderboard:
 
         return None
 
+    async def record_score_history(self):
+        """ Append the score changes published to the change stream since the last call to the score history.
+        @return: None
+        """
+        events, self.history_seq = self.change_stream.read(self.history_seq)
+
+        now = time.time()
+        records = [HistoryRecord(event.chart_id, event.new_score.player, now, event.new_score.score, event.new_score.rank)
+                   for event in events if event.kind in SCORE_UPDATE_KINDS]
+        await asyncio.to_thread(self.history.append, records)
+
+    async def query_score_history(self, player_ids: List[str], chart_id: str) -> dict[str, List[HistoryRecord]]:
+        """ Query players' score progression on a level.
+        @param player_ids: the player IDs, in the format of name[#tag]; If [#tag] is not specified, all players with the same name will be queried
+        @param chart_id: the level's ID
+        @return: dict of { player_id : list of HistoryRecords, oldest first, ending with the current score }
+        """
+        chart_id = chart_id.lower()
+        chart_scores = self.scores.get(chart_id)
+        # the current scores may predate the history, e.g. when a chart was first crawled
+        current = [HistoryRecord(chart_id, score.player, chart_scores.last_crawled or time.time(), score.score, score.rank)
+                   for player_id in player_ids for score in (chart_scores.find(player_id) if chart_scores is not None else [])]
+
+        return await self.query_history(chart_id, player_ids, current)
+
+    async def query_pumbility_history(self, player_ids: List[str]) -> dict[str, List[HistoryRecord]]:
+        """ Query players' Pumbility over time.
+        @param player_ids: the player IDs, in the format of name[#tag]; If [#tag] is not specified, all players with the same name will be queried
+        @return: dict of { player_id : list of HistoryRecords, oldest first, ending with the current Pumbility }
+        """
+        now = time.time()
+        current = [HistoryRecord(PUMBILITY_KEY, pumbility.player_id, now, pumbility.pumbility, pumbility.rank)
+                   for player_id in player_ids for pumbility in self.pumbility_ranking.find(player_id)]
+
+        return await self.query_history(PUMBILITY_KEY, player_ids, current)
+
+    async def query_history(self, key: str, player_ids: List[str], current: List[HistoryRecord]) -> dict[str, List[HistoryRecord]]:
+        """ Read players' history for a chart or Pumbility, and end it with their current value unless it was the last one recorded.
+        @param key: the chart's ID, lowercase, or PUMBILITY_KEY
+        @param player_ids: the player IDs, in the format of name[#tag]
+        @param current: the HistoryRecords of the matching players' current values
+        @return: dict of { player_id : list of HistoryRecords, oldest first }
+        """
+        history = dict()
+        for player_id in player_ids:
+            for matched_id in self.history.find_player_ids(player_id):
+                history[matched_id] = await asyncio.to_thread(self.history.get_history, key, matched_id)
+
+        for record in current:
+            records = history.setdefault(record.player_id, [])
+            if len(records) == 0 or records[-1].value != record.value:
+                records.append(record)
+
+        return { player_id: records for player_id, records in history.items() if len(records) > 0 }
+
     async def query_rank(self, rank: int, chart_id: str) -> List[Score]:
         """ Query all scores with a given rank on a level.
         @param rank: the rank to query
         @param chart_id: the level's ID
         @return: list(Score) of all matching rank scores on the given level
         """
-        # verify rank is between 1 and 100
-        if rank < 1 or rank > 100:
+        return await self.query_rank_range(rank, rank, chart_id)
+
+    async def query_rank_range(self, lo: int, hi: int, chart_id: str) -> List[Score]:
+        """ Query all scores within a range of ranks on a level.
+        Tied scores are returned as whole groups, even if only part of the group falls within the range.
+        @param lo: the first rank to query
+        @param hi: the last rank to query, inclusive
+        @param chart_id: the level's ID
+        @return: list(Score) of all matching scores on the given level, sorted by rank
+        """
+        # verify ranks are between 1 and 100
+        if lo < 1 or hi > 100 or lo > hi:
             return None
 
         chart_id = chart_id.lower()
 
         if chart_id in self.scores:
-            scores = []
-            i = 1
-            for key, value in self.scores[chart_id].items():
-                if rank == value.rank:
-                    scores.append(value)
-                elif rank == i:
-                    # score rank does not match actual rank, so there must be a tie with a higher rank
-                    return await self.query_rank(value.rank, chart_id)
-
-                i += 1
-
-            return scores
+            return self.scores[chart_id].find_rank_range(lo, hi)
 
         return None
 
-    async def get_score_updates(self, player_ids: Set[str]) -> List[tuple[Score, Score]]:
-        """ Get the leaderboard updates for all the players being tracked.
-        @param player_ids: the players to get updates for
-        @return: list of (new_score, prev_score) tuples
+    async def query_player_scores(self, player_ids: List[str], mode: str = None, level: str = None) -> List[Score]:
+        """ Query all of a player's scores across every chart, without rescraping.
+        @param player_ids: the player IDs, in the format of name[#tag]; If [#tag] is not specified, all players with the same name will be queried
+        @param mode: only include charts of this mode, if given
+        @param level: only include charts of this level, if given
+        @return: list(Score) of all matching players' scores, sorted by rank
         """
-        updates = []
-        for (new_score, prev_score) in self.score_updates:
-            if new_score is not None:
-                for player_id in player_ids:
-                    if new_score.player == player_id or ('#' not in player_id and new_score.player.split('#')[0] == player_id):
-                        updates.append((new_score, prev_score))
-                        break
+        scores = []
 
-        return updates
+        for player_id in player_ids:
+            for chart_id, score in self.player_index.find(player_id):
+                chart = self.charts.get(chart_id)
+                if chart is None:
+                    continue
+                if (mode is None or chart.mode == mode) and (level is None or chart.level.lower() == level):
+                    scores.append(score)
+
+        # sort scores by rank, then by chart
+        scores.sort(key=lambda score: (score.rank, score.chart.chart_id))
+
+        return scores
 
-    async def get_pumbility_updates(self, player_ids: Set[str]) -> List[tuple[Pumbility, Pumbility]]:
-        """ Get the leaderboard updates for all the players being tracked.
-        @param player_ids: the players to get updates for
-        @return: list of (new_pumbility, prev_pumbility) tuples
+    async def publish_score_updates(self):
+        """ Make the score updates found since the last publish available in score_updates, to be routed to the guilds tracking their players.
+        @return: None
         """
-        updates = []
-        for (new_pumbility, prev_pumbility) in self.pumbility_updates:
-            if new_pumbility is not None:
-                for player_id in player_ids:
-                    if new_pumbility.player_id == player_id or ('#' not in player_id and new_pumbility.player_id.split('#')[0] == player_id):
-                        updates.append((new_pumbility, prev_pumbility))
-                        break
+        events, self.score_updates_seq = self.change_stream.read(self.score_updates_seq)
+        self.score_updates = get_score_updates(events)
 
-        return updates
+    async def publish_pumbility_updates(self):
+        """ Make the Pumbility updates found since the last publish available in pumbility_updates, to be routed to the guilds tracking their players.
+        @return: None
+        """
+        self.pumbility_updates = self.new_pumbility_updates
+        self.new_pumbility_updates = []
 
     async def save_chart_leaderboards(self):
-        """Save the leaderboard to a file in JSON format.
+        """Save the leaderboards of all charts that changed since the last save.
+        The leaderboards are snapshotted now and written in the background.
         @return: None
         """
-        with open(self.LEADERBOARD_SAVE_FILE, 'w', encoding='utf-8') as f:
-            f.write(
-                json.dumps(
-                    { chart_id: { player_id: score.to_dict() for player_id, score in chart_scores.items() }
-                        for chart_id, chart_scores in self.scores.items() },
-                    indent=2
-                )
-            )
+        updated_charts = self.updated_charts
+        self.updated_charts = set()
+
+        for chart_id in updated_charts:
+            if chart_id in self.scores:
+                self.writer.schedule(self.store.get_chart_file(chart_id), self.store.snapshot_chart(chart_id, self.scores[chart_id]))
+
+    def load_pumbility_leaderboard(self) -> RankingDict:
+        """Load the Pumbility leaderboard from its snapshot, or from the JSON file it was saved to before snapshots.
+        @return: RankingDict of { player_id : Pumbility }
+        """
+        if os.path.isfile(self.PUMBILITY_SNAPSHOT_FILE):
+            try:
+                snapshot = Snapshot(self.PUMBILITY_SNAPSHOT_FILE)
+                try:
+                    entry = snapshot.entries[self.PUMBILITY_SECTION]
+                    return RankingDict({
+                        row.player: Pumbility(row.player, row.value, row.rank, row.tie_count, row.title, row.avatar_id, row.date)
+                        for row in snapshot.read_rows(entry)
+                    })
+                finally:
+                    snapshot.close()
+            except (OSError, KeyError, SnapshotError):
+                logger.exception(f'Failed to load {self.PUMBILITY_SNAPSHOT_FILE}')
+
+        if os.path.isfile(self.PUMBILITY_SAVE_FILE):
+            with open(self.PUMBILITY_SAVE_FILE, 'r', encoding='utf-8') as f:
+                return RankingDict({
+                    player_id: Pumbility.from_dict(pumbility)
+                    for player_id, pumbility in json.load(f).items()
+                })
+
+        return RankingDict()
 
     async def save_pumbility_leaderboard(self):
-        """Save the Pumbility leaderboard to a file in JSON format.
+        """Save the Pumbility leaderboard to its snapshot.
+        The leaderboard is snapshotted now, and encoded and written in the background.
+        @return: None
+        """
+        rows = [
+            SnapshotRow(player_id, pumbility.pumbility, pumbility.rank, pumbility.tie_count, pumbility.avatar_id, pumbility.date, pumbility.title)
+            for player_id, pumbility in self.pumbility_ranking.items()
+        ]
+        self.writer.schedule(self.PUMBILITY_SNAPSHOT_FILE, [SnapshotSection(self.PUMBILITY_SECTION, rows)], serialize=encode_snapshot)
+
+    async def flush(self):
+        """Wait until all scheduled saves have been written.
         @return: None
         """
-        with open(self.PUMBILITY_SAVE_FILE, 'w', encoding='utf-8') as f:
-            f.write(
-                json.dumps(
-                    { player_id: pumbility.to_dict() for player_id, pumbility in self.pumbility_ranking.items() },
-                    indent=2
-                )
-            )
+        await self.writer.flush()
@@ -1,28 +1,56 @@
 # leaderboard_crawler.py
 
-from typing import List
+import hashlib
+import time
+from collections import Counter
+from typing import List, Set
 
 import scrapy
 
 from chart import Chart
 from score import Score
 
+from leaderboard_diff import ChangeEvent, diff_rankings
 from piugame_crawler import PIUGAME_CRAWLER
+from player_index import PlayerIndex
+from ranking_dict import RankingDict
 from util import update_curr_tie_count, update_next_tie_count
 
 class LeaderboardCrawler(scrapy.Spider):
     name = 'leaderboard_spider'
 
-    def __init__(self, leaderboard_urls: dict[str, Chart], scores: dict, score_updates: List[tuple[Score, Score]]):
+    def __init__(self, leaderboard_urls: dict[str, Chart], scores: dict, change_events: List[ChangeEvent], updated_charts: Set[str], player_index: PlayerIndex, crawl_stats: Counter):
         """Initialize the leaderboard crawler.
         @param leaderboard_urls: dict of { url : Chart }
-        @param scores: dict of { chart_id : dict of { player_id : Score } }
+        @param scores: dict of { chart_id : RankingDict of { player_id : Score } }
+        @param change_events: list of the ChangeEvents found by diffing each chart against its previous crawl
+        @param updated_charts: set of the chart ids whose leaderboards changed
+        @param player_index: the index of every player's scores across all charts
+        @param crawl_stats: counts of the pages that were parsed, unchanged or not modified
         @return: None
         """
         self.start_urls = leaderboard_urls.keys()
         self.charts = leaderboard_urls
         self.scores = scores
-        self.score_updates = score_updates
+        self.change_events = change_events
+        self.updated_charts = updated_charts
+        self.player_index = player_index
+        self.crawl_stats = crawl_stats
+
+    def start_requests(self):
+        """Request each leaderboard page, conditionally on it having changed if the server gave us validators last time.
+        @return: the requests for the leaderboard pages
+        """
+        for url, chart in self.charts.items():
+            headers = dict()
+            prev_scores = self.scores.get(chart.chart_id.lower())
+            if prev_scores is not None:
+                if prev_scores.etag is not None:
+                    headers['If-None-Match'] = prev_scores.etag
+                if prev_scores.last_modified is not None:
+                    headers['If-Modified-Since'] = prev_scores.last_modified
+
+            yield scrapy.Request(url, headers=headers, meta={'handle_httpstatus_list': [304]}, dont_filter=True)
 
     def parse(self, response):
         """Parse the leaderboard page.
@@ -31,24 +59,32 @@ class LeaderboardCrawler(scrapy.Spider):
         """
         chart = self.charts[response.request.meta['redirect_urls'][0] if 'redirect_urls' in response.request.meta else response.request.url]
         chart_key = chart.chart_id.lower()
+        prev_scores = self.scores.get(chart_key)
+
+        if response.status == 304:
+            self.skip_unchanged(prev_scores, 'not_modified')
+            return
 
-        scores_dict = dict()
+        # skip parsing altogether if the ranking list is byte-identical to last time
+        ranking_list_w = response.xpath('//div[@class="rangking_list_w"]')
+        page_digest = hashlib.blake2b(ranking_list_w.get('').encode('utf-8'), digest_size=16).hexdigest()
+        if prev_scores is not None and prev_scores.page_digest == page_digest:
+            self.skip_unchanged(prev_scores, 'unchanged', response)
+            return
+
+        self.crawl_stats['parsed'] += 1
+
+        scores_dict = RankingDict()
 
         tie_count = 1
         previous_rank = 0
         previous_player_id = ''
         curr_tied_players = []
 
-        ranking_list = response.xpath('//div[@class="rangking_list_w"]//ul[@class="list"]/li')
+        ranking_list = ranking_list_w.xpath('.//ul[@class="list"]/li')
 
         for i, ranking in enumerate(ranking_list):
-            ranking_info = ranking.xpath('.//div[@class="in flex vc wrap"]')
-
-            rank = PIUGAME_CRAWLER.parse_rank(ranking_info)
-            player_id = PIUGAME_CRAWLER.parse_player_id(ranking_info, pumbility=False)
-            score = PIUGAME_CRAWLER.parse_score(ranking_info)
-            avatar_id = PIUGAME_CRAWLER.parse_avatar_id(ranking_info, pumbility=False)
-            date = PIUGAME_CRAWLER.parse_date(ranking)
+            rank, player_id, score, avatar_id, date, _ = PIUGAME_CRAWLER.parse_row(ranking, pumbility=False)
 
             tie_count = update_curr_tie_count(tie_count, rank, previous_rank, player_id, previous_player_id, curr_tied_players)
             scores_dict[player_id] = Score(chart=chart, player=player_id, score=score, rank=rank, tie_count=tie_count, avatar_id=avatar_id, date=date)
@@ -57,15 +93,56 @@ class LeaderboardCrawler(scrapy.Spider):
             previous_rank = rank
             previous_player_id = player_id
 
-        # check for + store score updates if we have previous scores to compare to
-        if chart_key in self.scores and len(self.scores[chart_key]) > 0:
-            for player_id, score in scores_dict.items():
-                if player_id in self.scores[chart_key]:
-                    if score.score > self.scores[chart_key][player_id].score:
-                        # score has been updated
-                        self.score_updates.append((score, self.scores[chart_key][player_id]))
-                else:
-                    # new score
-                    self.score_updates.append((score, None))
+        # check for + store changes if we have previous scores to compare to
+        if prev_scores is not None and len(prev_scores) > 0:
+            self.change_events.extend(diff_rankings(chart_key, prev_scores, scores_dict))
 
+        # the page can differ without the leaderboard changing, e.g. in its markup, which is not worth rewriting the chart's file for;
+        # the new digest is saved with the chart at the next compaction
+        if prev_scores is None or scores_changed(prev_scores, scores_dict):
+            self.updated_charts.add(chart_key)
+
+        scores_dict.last_crawled = time.time()
+        scores_dict.page_digest = page_digest
+        store_validators(scores_dict, response)
+
+        self.player_index.update_chart(chart_key, self.scores.get(chart_key), scores_dict)
         self.scores[chart_key] = scores_dict
+
+    def skip_unchanged(self, prev_scores: RankingDict, reason: str, response=None):
+        """Keep a chart's previous leaderboard for a page that did not change.
+        Its crawl time and validators are only updated in memory, and saved with the chart at the next compaction.
+        @param prev_scores: the chart's RankingDict from the previous crawl
+        @param reason: the crawl stat to count the page under
+        @param response: the response, to refresh the page's validators from
+        @return: None
+        """
+        self.crawl_stats[reason] += 1
+        if prev_scores is None:
+            return
+
+        prev_scores.last_crawled = time.time()
+        if response is not None:
+            store_validators(prev_scores, response)
+
+def store_validators(scores: RankingDict, response):
+    """Store the ETag and Last-Modified headers of a leaderboard page, if the server sent any.
+    @param scores: the chart's RankingDict
+    @param response: the response from the leaderboard page
+    @return: None
+    """
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    scores.etag = etag.decode('latin-1') if etag is not None else None
+    scores.last_modified = last_modified.decode('latin-1') if last_modified is not None else None
+
+def scores_changed(prev_scores: dict[str, Score], scores: dict[str, Score]) -> bool:
+    """Check whether a chart's leaderboard differs from its previous version.
+    @param prev_scores: dict of { player_id : Score } from the previous crawl
+    @param scores: dict of { player_id : Score } from the current crawl
+    @return: True if any entry was added, removed or modified, False otherwise
+    """
+    if prev_scores.keys() != scores.keys():
+        return True
+
+    return any(score.to_dict() != prev_scores[player_id].to_dict() for player_id, score in scores.items())
@@ -0,0 +1,103 @@
+# leaderboard_diff.py
+# Compares consecutive crawls of a chart's leaderboard and describes what changed as typed events.
+
+from collections import deque
+from typing import List
+
+from ranking_dict import RankingDict
+from score import Score
+
+IMPROVEMENT = 'improvement'
+NEW_ENTRY = 'new_entry'
+RANK_DROP = 'rank_drop'
+DROPPED_OFF = 'dropped_off'
+TIE_FORMED = 'tie_formed'
+TIE_BROKEN = 'tie_broken'
+
+# the events that notify guilds tracking the player
+SCORE_UPDATE_KINDS = set([IMPROVEMENT, NEW_ENTRY])
+
+class ChangeEvent:
+    def __init__(self, kind: str, chart_id: str, new_score: Score, prev_score: Score):
+        """Initialize a change event.
+        @param kind: the kind of change, e.g. IMPROVEMENT
+        @param chart_id: the chart's ID, lowercase
+        @param new_score: the player's score after the change, or None if they dropped off the leaderboard
+        @param prev_score: the player's score before the change, or None if they are new to the leaderboard
+        """
+        self.kind = kind
+        self.chart_id = chart_id
+        self.new_score = new_score
+        self.prev_score = prev_score
+
+    def player_id(self) -> str:
+        return (self.new_score or self.prev_score).player
+
+def diff_rankings(chart_id: str, prev_scores: RankingDict, scores: RankingDict) -> List[ChangeEvent]:
+    """Compare two crawls of a chart's leaderboard in one linear pass over each.
+    @param chart_id: the chart's ID, lowercase
+    @param prev_scores: RankingDict of { player_id : Score } from the previous crawl
+    @param scores: RankingDict of { player_id : Score } from the current crawl
+    @return: list of ChangeEvents, in rank order of the current crawl followed by drop-outs in their previous rank order
+    """
+    events = []
+
+    for score in scores.get_rank_order():
+        prev_score = prev_scores.get(score.player)
+
+        if prev_score is None:
+            events.append(ChangeEvent(NEW_ENTRY, chart_id, score, None))
+            continue
+
+        if score.score > prev_score.score:
+            events.append(ChangeEvent(IMPROVEMENT, chart_id, score, prev_score))
+        elif score.rank > prev_score.rank:
+            # pushed down by other players
+            events.append(ChangeEvent(RANK_DROP, chart_id, score, prev_score))
+
+        if score.tie_count > 1 and prev_score.tie_count == 1:
+            events.append(ChangeEvent(TIE_FORMED, chart_id, score, prev_score))
+        elif score.tie_count == 1 and prev_score.tie_count > 1:
+            events.append(ChangeEvent(TIE_BROKEN, chart_id, score, prev_score))
+
+    for prev_score in prev_scores.get_rank_order():
+        if prev_score.player not in scores:
+            events.append(ChangeEvent(DROPPED_OFF, chart_id, None, prev_score))
+
+    return events
+
+def get_score_updates(events: List[ChangeEvent]) -> List[tuple[Score, Score]]:
+    """Get the score updates that guilds are notified of from a list of events.
+    @param events: the ChangeEvents
+    @return: list of (new_score, prev_score) tuples for improvements and new entries
+    """
+    return [(event.new_score, event.prev_score) for event in events if event.kind in SCORE_UPDATE_KINDS]
+
+class ChangeStream:
+    def __init__(self, max_events: int = 100000):
+        """Initialize the change stream, a bounded log of the most recent events.
+        @param max_events: the number of events to keep; older events are discarded
+        """
+        self.events = deque(maxlen=max_events)
+        # sequence number of the next event to be published
+        self.next_seq = 0
+
+    def publish(self, events: List[ChangeEvent]):
+        """Append events to the stream.
+        @param events: the ChangeEvents to append
+        @return: None
+        """
+        for event in events:
+            self.events.append((self.next_seq, event))
+            self.next_seq += 1
+
+    def read(self, since_seq: int) -> tuple[List[ChangeEvent], int]:
+        """Read the events published since a consumer's last read.
+        Events that were discarded before the consumer caught up are skipped.
+        @param since_seq: the sequence number returned by the consumer's last read, or 0 to read everything kept
+        @return: (list of ChangeEvents, the sequence number to pass to the next read)
+        """
+        first_seq = self.next_seq - len(self.events)
+        start = max(since_seq - first_seq, 0)
+
+        return [event for _, event in list(self.events)[start:]], self.next_seq
@@ -0,0 +1,212 @@
+# leaderboard_snapshot.py
+# A versioned binary snapshot of rankings: one string table shared by every section, and packed integer columns per section.
+# Sections are found through a directory, so one can be read from a memory map without decoding the others.
+#
+# Layout, little-endian:
+#   header     magic, version, string table offset, directory offset, section count
+#   sections   per section, one array per column: player, value, avatar_id, date, title (uint32 string indexes, or
+#              values), then rank, tie_count (uint16)
+#   strings    string count, count + 1 uint32 offsets into the UTF-8 data, then the data
+#   directory  per section: name, offset, row count, last_crawled, page_digest, etag, last_modified
+
+import mmap
+import struct
+import sys
+from array import array
+from typing import Iterable, List, NamedTuple
+
+MAGIC = b'PIUSNAP\x00'
+VERSION = 1
+
+HEADER = struct.Struct('<8sHxxQQI')
+DIRECTORY_ENTRY = struct.Struct('<IQIdIII')
+
+# string index of missing values, and last_crawled of sections that were never crawled
+NONE = 0xFFFFFFFF
+NEVER = float('nan')
+
+# (column, array typecode) in the order they are stored in a section
+COLUMNS = [
+    ('player', 'I'),
+    ('value', 'I'),
+    ('avatar_id', 'I'),
+    ('date', 'I'),
+    ('title', 'I'),
+    ('rank', 'H'),
+    ('tie_count', 'H'),
+]
+STRING_COLUMNS = set(['player', 'avatar_id', 'date', 'title'])
+
+class SnapshotRow(NamedTuple):
+    player: str
+    value: int
+    rank: int
+    tie_count: int
+    avatar_id: str
+    date: str
+    title: str
+
+class SnapshotSection(NamedTuple):
+    name: str
+    rows: List[SnapshotRow]
+    last_crawled: float = None
+    page_digest: str = None
+    etag: str = None
+    last_modified: str = None
+
+class SnapshotEntry(NamedTuple):
+    name: str
+    offset: int
+    num_rows: int
+    last_crawled: float
+    page_digest: str
+    etag: str
+    last_modified: str
+
+class SnapshotError(Exception):
+    pass
+
+def pack_column(values: Iterable[int], typecode: str) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+def unpack_column(data, typecode: str) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def encode_snapshot(sections: Iterable[SnapshotSection]) -> bytes:
+    """Encode sections into a snapshot.
+    @param sections: the sections to store; section names must be unique
+    @return: the snapshot's bytes
+    """
+    # strings is dict of { string : index }, in insertion order
+    strings = dict()
+
+    def string_index(value: str) -> int:
+        if value is None:
+            return NONE
+        return strings.setdefault(value, len(strings))
+
+    body = bytearray(HEADER.size)
+    entries = []
+
+    for section in sections:
+        offset = len(body)
+        for column, typecode in COLUMNS:
+            if column in STRING_COLUMNS:
+                values = [string_index(getattr(row, column)) for row in section.rows]
+            else:
+                values = [getattr(row, column) for row in section.rows]
+            body += pack_column(values, typecode)
+
+        entries.append((string_index(section.name), offset, len(section.rows),
+                        section.last_crawled if section.last_crawled is not None else NEVER,
+                        string_index(section.page_digest), string_index(section.etag), string_index(section.last_modified)))
+
+    strings_offset = len(body)
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    body += struct.pack('<I', len(encoded))
+    body += pack_column(offsets, 'I')
+    body += b''.join(encoded)
+
+    directory_offset = len(body)
+    for entry in entries:
+        body += DIRECTORY_ENTRY.pack(*entry)
+
+    HEADER.pack_into(body, 0, MAGIC, VERSION, strings_offset, directory_offset, len(entries))
+
+    return bytes(body)
+
+class Snapshot:
+    def __init__(self, path: str):
+        """Open a snapshot. Only the header, string offsets and directory are read; sections are read on demand.
+        @param path: the snapshot file
+        @raise SnapshotError: if the file is not a snapshot of a supported version
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise SnapshotError(f'{path} is too short to be a snapshot')
+
+        magic, version, strings_offset, directory_offset, num_sections = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f'{path} is not a snapshot')
+        if version != VERSION:
+            raise SnapshotError(f'{path} is snapshot version {version}, expected {VERSION}')
+
+        num_strings, = struct.unpack_from('<I', self.data, strings_offset)
+        self.string_offsets = unpack_column(self.data[strings_offset + 4:strings_offset + 4 + (num_strings + 1) * 4], 'I')
+        self.strings_start = strings_offset + 4 + (num_strings + 1) * 4
+        # strings are decoded on first use
+        self.strings = [None] * num_strings
+
+        # entries is dict of { section name : SnapshotEntry }
+        self.entries = dict()
+        for i in range(num_sections):
+            name, offset, num_rows, last_crawled, page_digest, etag, last_modified = \
+                DIRECTORY_ENTRY.unpack_from(self.data, directory_offset + i * DIRECTORY_ENTRY.size)
+            entry = SnapshotEntry(
+                name=self.get_string(name),
+                offset=offset,
+                num_rows=num_rows,
+                last_crawled=last_crawled if last_crawled == last_crawled else None,
+                page_digest=self.get_string(page_digest),
+                etag=self.get_string(etag),
+                last_modified=self.get_string(last_modified),
+            )
+            self.entries[entry.name] = entry
+
+    def get_string(self, index: int) -> str:
+        if index == NONE:
+            return None
+
+        value = self.strings[index]
+        if value is None:
+            start = self.strings_start + self.string_offsets[index]
+            end = self.strings_start + self.string_offsets[index + 1]
+            value = self.strings[index] = self.data[start:end].decode('utf-8')
+
+        return value
+
+    def read_column(self, entry: SnapshotEntry, column: str) -> list:
+        """Read a single column of a section.
+        @param entry: the section's directory entry
+        @param column: the column's name, one of COLUMNS
+        @return: list of the column's values, with string indexes resolved
+        """
+        offset = entry.offset
+        for name, typecode in COLUMNS:
+            size = array(typecode).itemsize * entry.num_rows
+            if name == column:
+                values = unpack_column(self.data[offset:offset + size], typecode)
+                if column not in STRING_COLUMNS:
+                    return values.tolist()
+
+                # most strings are shared between sections and already decoded, so only the rest go through get_string
+                strings = self.strings
+                return [strings[value] if value != NONE and strings[value] is not None else self.get_string(value) for value in values]
+            offset += size
+
+        raise KeyError(column)
+
+    def read_rows(self, entry: SnapshotEntry) -> List[SnapshotRow]:
+        """Read a section's rows.
+        @param entry: the section's directory entry
+        @return: list of SnapshotRows, in the order they were stored
+        """
+        columns = { column: self.read_column(entry, column) for column, _ in COLUMNS }
+        return [SnapshotRow(*row) for row in zip(*(columns[field] for field in SnapshotRow._fields))]
+
+    def close(self):
+        self.data.close()
@@ -0,0 +1,427 @@
+# leaderboard_store.py
+# Storage for the chart leaderboards: a binary snapshot of every chart, and a JSON file per chart saved since the snapshot.
+# A crawl only rewrites the charts that changed; compacting folds the per-chart files back into the snapshot.
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Iterable, List
+
+from chart import Chart
+from leaderboard_snapshot import Snapshot, SnapshotEntry, SnapshotError, SnapshotRow, SnapshotSection, encode_snapshot
+from ranking_dict import RankingDict
+from score import Score
+from util import write_atomic
+
+logger = logging.getLogger('discord')
+
+class LeaderboardStore:
+    SNAPSHOT_FILE = 'leaderboard.snap'
+
+    def __init__(self, store_dir: str):
+        """Initialize the leaderboard store.
+        @param store_dir: the directory holding the snapshot and one JSON file per chart saved since
+        """
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        # the open snapshot that the loaded records read from, closed once a newer snapshot replaces it
+        self.snapshot = None
+
+    def get_chart_file(self, chart_id: str) -> str:
+        """Get the file a chart's leaderboard is stored in until the next compaction.
+        Chart IDs contain spaces and punctuation, so the file is named after a hash of the ID.
+        @param chart_id: the chart's ID, lowercase
+        @return: the path to the chart's file
+        """
+        digest = hashlib.sha1(chart_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.store_dir, f'{digest}.json')
+
+    def get_snapshot_file(self) -> str:
+        return os.path.join(self.store_dir, self.SNAPSHOT_FILE)
+
+    def get_chart_files(self) -> List[str]:
+        """Get the per-chart files saved since the last compaction.
+        @return: list of paths
+        """
+        return [entry.path for entry in os.scandir(self.store_dir) if entry.name.endswith('.json')]
+
+    def is_empty(self) -> bool:
+        """Check whether the store has any saved charts.
+        @return: True if no charts have been saved yet, False otherwise
+        """
+        return not os.path.isfile(self.get_snapshot_file()) and len(self.get_chart_files()) == 0
+
+    def load(self, charts: dict[str, Chart]) -> 'LazyScores':
+        """Load all saved chart leaderboards as raw records, to be turned into Scores when each chart is first accessed.
+        Charts are read from the snapshot, unless they were saved to their own file since.
+        The snapshot of an earlier load is closed, so the LazyScores it returned must no longer be used.
+        @param charts: dict of { chart_id : Chart }
+        @return: LazyScores of { chart_id : RankingDict of { player_id : Score } }
+        """
+        records = dict()
+
+        if os.path.isfile(self.get_snapshot_file()):
+            try:
+                snapshot = Snapshot(self.get_snapshot_file())
+                for chart_id, entry in snapshot.entries.items():
+                    records[chart_id] = SnapshotChartRecord(snapshot, entry)
+                self.swap_snapshot(snapshot)
+            except (OSError, SnapshotError):
+                logger.exception(f'Failed to open {self.get_snapshot_file()}, loading only the per-chart files')
+
+        for path in self.get_chart_files():
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            records[data['chart_id']] = JsonChartRecord(data)
+
+        return LazyScores(records, charts)
+
+    def snapshot_chart(self, chart_id: str, chart_scores: dict[str, Score]) -> dict:
+        """Take a JSON-serializable snapshot of a chart's leaderboard.
+        @param chart_id: the chart's ID, lowercase
+        @param chart_scores: dict of { player_id : Score }
+        @return: the snapshot to save in the chart's file
+        """
+        return {
+            'chart_id': chart_id,
+            'last_crawled': getattr(chart_scores, 'last_crawled', None),
+            'page_digest': getattr(chart_scores, 'page_digest', None),
+            'etag': getattr(chart_scores, 'etag', None),
+            'last_modified': getattr(chart_scores, 'last_modified', None),
+            'scores': { player_id: score.to_dict() for player_id, score in chart_scores.items() },
+        }
+
+    def save_chart(self, chart_id: str, chart_scores: dict[str, Score]):
+        """Save a single chart's leaderboard, replacing the previous file atomically.
+        @param chart_id: the chart's ID, lowercase
+        @param chart_scores: dict of { player_id : Score }
+        @return: None
+        """
+        write_atomic(self.get_chart_file(chart_id), json.dumps(self.snapshot_chart(chart_id, chart_scores), indent=2))
+
+    def save_charts(self, scores: dict, chart_ids: Iterable[str]):
+        """Save the leaderboards for the given charts.
+        @param scores: dict of { chart_id : dict of { player_id : Score } }
+        @param chart_ids: the IDs of the charts to save
+        @return: None
+        """
+        for chart_id in chart_ids:
+            if chart_id in scores:
+                self.save_chart(chart_id, scores[chart_id])
+
+    def remove_chart(self, chart_id: str):
+        """Remove a chart's own file, e.g. when the chart is removed from the songlist.
+        The chart is left out of the snapshot at the next compaction.
+        @param chart_id: the chart's ID, lowercase
+        @return: None
+        """
+        try:
+            os.remove(self.get_chart_file(chart_id))
+        except FileNotFoundError:
+            pass
+
+    def swap_snapshot(self, snapshot: Snapshot):
+        """Replace the open snapshot, closing the previous one. No record may still read from the previous snapshot.
+        @param snapshot: the new snapshot
+        @return: None
+        """
+        prev_snapshot = self.snapshot
+        self.snapshot = snapshot
+        if prev_snapshot is not None:
+            prev_snapshot.close()
+
+    def compact(self, scores: 'LazyScores'):
+        """Write every chart into a new snapshot, and remove the per-chart files it replaces.
+        The records that have not been hydrated are moved to the new snapshot, and the previous snapshot is closed.
+        Must not run while chart files are being written.
+        @param scores: LazyScores of every chart leaderboard
+        @return: None
+        """
+        chart_files = self.get_chart_files()
+
+        write_atomic(self.get_snapshot_file(), encode_snapshot(scores.get_sections()))
+
+        snapshot = Snapshot(self.get_snapshot_file())
+        scores.move_records(snapshot)
+        self.swap_snapshot(snapshot)
+
+        for path in chart_files:
+            os.remove(path)
+
+        logger.info(f'Compacted {len(chart_files)} chart files into a snapshot of {len(scores)} charts')
+
+    def import_json(self, leaderboards: dict):
+        """Replace the store's contents with chart leaderboards in the single-file JSON format.
+        @param leaderboards: dict of { chart_id : dict of { player_id : score dict } }
+        @return: None
+        """
+        sections = [
+            JsonChartRecord({ 'chart_id': chart_id, 'scores': chart_scores }).get_section(chart_id)
+            for chart_id, chart_scores in leaderboards.items()
+        ]
+        write_atomic(self.get_snapshot_file(), encode_snapshot(sections))
+
+        for path in self.get_chart_files():
+            os.remove(path)
+
+    def export_json(self) -> dict:
+        """Get the store's contents in the single-file JSON format.
+        @return: dict of { chart_id : dict of { player_id : score dict } }
+        """
+        scores = self.load(dict())
+        return {
+            chart_id: { player_id: score.to_dict() for player_id, score in chart_scores.items() }
+            for chart_id, chart_scores in scores.items()
+        }
+
+def get_section(chart_id: str, chart_scores: RankingDict) -> SnapshotSection:
+    """Get the snapshot section of a chart's leaderboard.
+    @param chart_id: the chart's ID, lowercase
+    @param chart_scores: RankingDict of { player_id : Score }
+    @return: the chart's SnapshotSection
+    """
+    return SnapshotSection(
+        name=chart_id,
+        rows=[SnapshotRow(score.player, score.score, score.rank, score.tie_count, score.avatar_id, score.date, None) for score in chart_scores.values()],
+        last_crawled=chart_scores.last_crawled,
+        page_digest=chart_scores.page_digest,
+        etag=chart_scores.etag,
+        last_modified=chart_scores.last_modified,
+    )
+
+class JsonChartRecord:
+    def __init__(self, data: dict):
+        """Initialize the raw record of a chart read from its own file.
+        @param data: the chart's decoded file
+        """
+        self.data = data
+        self.last_crawled = data.get('last_crawled')
+
+    def get_player_ids(self) -> Iterable[str]:
+        return self.data['scores'].keys()
+
+    def get_section(self, chart_id: str) -> SnapshotSection:
+        return SnapshotSection(
+            name=chart_id,
+            rows=[SnapshotRow(score['player'], score['score'], score['rank'], score['tie_count'], score['avatar_id'], score['date'], None)
+                  for score in self.data['scores'].values()],
+            last_crawled=self.last_crawled,
+            page_digest=self.data.get('page_digest'),
+            etag=self.data.get('etag'),
+            last_modified=self.data.get('last_modified'),
+        )
+
+    def hydrate(self, chart: Chart) -> RankingDict:
+        """Turn the record into the chart's leaderboard.
+        @param chart: the chart, or None if it is no longer in the songlist
+        @return: RankingDict of { player_id : Score }
+        """
+        chart_scores = RankingDict({
+            player_id: Score.from_dict(score, chart)
+            for player_id, score in self.data['scores'].items()
+        })
+        chart_scores.last_crawled = self.last_crawled
+        chart_scores.page_digest = self.data.get('page_digest')
+        chart_scores.etag = self.data.get('etag')
+        chart_scores.last_modified = self.data.get('last_modified')
+
+        return chart_scores
+
+class SnapshotChartRecord:
+    def __init__(self, snapshot: Snapshot, entry: SnapshotEntry):
+        """Initialize the raw record of a chart in the snapshot. Nothing is decoded until it is needed.
+        @param snapshot: the open snapshot
+        @param entry: the chart's directory entry
+        """
+        self.snapshot = snapshot
+        self.entry = entry
+        self.last_crawled = entry.last_crawled
+
+    def get_player_ids(self) -> Iterable[str]:
+        return self.snapshot.read_column(self.entry, 'player')
+
+    def get_section(self, chart_id: str) -> SnapshotSection:
+        return SnapshotSection(chart_id, self.snapshot.read_rows(self.entry), self.last_crawled,
+                               self.entry.page_digest, self.entry.etag, self.entry.last_modified)
+
+    def hydrate(self, chart: Chart) -> RankingDict:
+        """Turn the record into the chart's leaderboard.
+        @param chart: the chart, or None if it is no longer in the songlist
+        @return: RankingDict of { player_id : Score }
+        """
+        chart_scores = RankingDict({
+            row.player: Score(chart, row.player, row.value, row.rank, row.tie_count, row.avatar_id, row.date)
+            for row in self.snapshot.read_rows(self.entry)
+        })
+        chart_scores.last_crawled = self.last_crawled
+        chart_scores.page_digest = self.entry.page_digest
+        chart_scores.etag = self.entry.etag
+        chart_scores.last_modified = self.entry.last_modified
+
+        return chart_scores
+
+class LazyScores:
+    """dict-like of { chart_id : RankingDict of { player_id : Score } } whose charts start out as raw records.
+    A chart's record is turned into Scores when the chart is first accessed, i.e. when it is first queried, crawled or diffed.
+    Iterating over items or values hydrates every chart.
+    """
+    def __init__(self, records: dict, charts: dict[str, Chart]):
+        """Initialize the lazily loaded chart leaderboards.
+        @param records: dict of { chart_id : the chart's JsonChartRecord or SnapshotChartRecord }
+        @param charts: dict of { chart_id : Chart }, looked up when a chart is hydrated
+        """
+        self.records = records
+        self.charts = charts
+        self.hydrated = dict()
+
+        # called with (chart_id, RankingDict) whenever a chart is hydrated
+        self.on_hydrate = None
+
+        # charts may be accessed from the crawler's thread as well as the event loop
+        self.lock = threading.Lock()
+
+    def __contains__(self, chart_id: str) -> bool:
+        # hydrate adds a chart before removing its record, so a chart is always in one or the other
+        return chart_id in self.hydrated or chart_id in self.records
+
+    def __len__(self) -> int:
+        return len(self.hydrated) + len(self.records)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, chart_id: str) -> RankingDict:
+        chart_scores = self.get(chart_id)
+        if chart_scores is None:
+            raise KeyError(chart_id)
+        return chart_scores
+
+    def __setitem__(self, chart_id: str, chart_scores: RankingDict):
+        with self.lock:
+            self.hydrated[chart_id] = chart_scores
+            self.records.pop(chart_id, None)
+
+    def get(self, chart_id: str, default=None) -> RankingDict:
+        chart_scores = self.hydrated.get(chart_id)
+        if chart_scores is None:
+            chart_scores = self.hydrate(chart_id)
+        return chart_scores if chart_scores is not None else default
+
+    def pop(self, chart_id: str, default=None) -> RankingDict:
+        # a chart that was never hydrated is dropped as a record, without creating its Scores
+        with self.lock:
+            chart_scores = self.hydrated.pop(chart_id, None)
+            self.records.pop(chart_id, None)
+        return chart_scores if chart_scores is not None else default
+
+    def is_hydrated(self, chart_id: str) -> bool:
+        return chart_id in self.hydrated
+
+    def keys(self) -> list:
+        # held so that a chart hydrated meanwhile is not missed or listed twice
+        with self.lock:
+            return list(self.hydrated.keys()) + list(self.records.keys())
+
+    def values(self) -> list:
+        self.hydrate_all()
+        return list(self.hydrated.values())
+
+    def items(self) -> list:
+        self.hydrate_all()
+        return list(self.hydrated.items())
+
+    def get_player_ids(self, chart_id: str) -> Iterable[str]:
+        """Get the IDs of the players on a chart, without hydrating it.
+        @param chart_id: the chart's ID, lowercase
+        @return: the player IDs, or an empty tuple if the chart is unknown
+        """
+        chart_scores = self.hydrated.get(chart_id)
+        if chart_scores is not None:
+            return chart_scores.keys()
+
+        record = self.records.get(chart_id)
+        return record.get_player_ids() if record is not None else ()
+
+    def get_last_crawled(self, chart_id: str) -> float:
+        """Get the time a chart was last crawled, without hydrating it.
+        @param chart_id: the chart's ID, lowercase
+        @return: unix time of the last crawl, or None if the chart was never crawled
+        """
+        chart_scores = self.hydrated.get(chart_id)
+        if chart_scores is not None:
+            return chart_scores.last_crawled
+
+        record = self.records.get(chart_id)
+        return record.last_crawled if record is not None else None
+
+    def hydrate(self, chart_id: str) -> RankingDict:
+        """Turn a chart's record into its leaderboard, if it has not been already.
+        @param chart_id: the chart's ID, lowercase
+        @return: the chart's RankingDict, or None if the chart is unknown
+        """
+        with self.lock:
+            chart_scores = self.hydrated.get(chart_id)
+            if chart_scores is not None:
+                return chart_scores
+
+            record = self.records.get(chart_id)
+            if record is None:
+                return None
+
+            chart_scores = record.hydrate(self.charts.get(chart_id))
+            self.hydrated[chart_id] = chart_scores
+            del self.records[chart_id]
+
+            if self.on_hydrate is not None:
+                self.on_hydrate(chart_id, chart_scores)
+
+        return chart_scores
+
+    def hydrate_all(self):
+        """Hydrate every chart that has not been yet.
+        @return: None
+        """
+        for chart_id in list(self.records.keys()):
+            self.hydrate(chart_id)
+
+    def move_records(self, snapshot: Snapshot):
+        """Replace the records of the charts that have not been hydrated with their sections in a new snapshot, e.g. after compaction,
+        so that none read from the previous snapshot or hold a per-chart file's contents.
+        @param snapshot: the new snapshot, holding every chart that has a record
+        @return: None
+        """
+        with self.lock:
+            self.records = { chart_id: SnapshotChartRecord(snapshot, snapshot.entries[chart_id]) for chart_id in self.records }
+
+    def get_sections(self) -> List[SnapshotSection]:
+        """Get the snapshot section of every chart, without hydrating any.
+        @return: list of SnapshotSections
+        """
+        with self.lock:
+            hydrated = list(self.hydrated.items())
+            records = list(self.records.items())
+
+        return [get_section(chart_id, chart_scores) for chart_id, chart_scores in hydrated] + \
+               [record.get_section(chart_id) for chart_id, record in records]
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a leaderboard store to and from the single-file JSON format.')
+    parser.add_argument('command', choices=['import', 'export'], help='import a JSON file into the store, or export the store to a JSON file')
+    parser.add_argument('store_dir', help='the leaderboard store directory, e.g. data/leaderboard')
+    parser.add_argument('json_file', help='the JSON file, e.g. data/leaderboard.json')
+    args = parser.parse_args()
+
+    store = LeaderboardStore(args.store_dir)
+    if args.command == 'import':
+        with open(args.json_file, 'r', encoding='utf-8') as f:
+            store.import_json(json.load(f))
+    else:
+        write_atomic(args.json_file, json.dumps(store.export_json(), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# outbound_queue.py
+# Queues update embeds per channel, packs them into as few messages as possible and sends to every channel concurrently.
+
+import asyncio
+import io
+import logging
+import time
+from collections import deque
+
+import discord
+
+logger = logging.getLogger('discord')
+
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+
+class TokenBucket:
+    def __init__(self, capacity: int, refill_rate: float):
+        """Initialize a token bucket, full.
+        @param capacity: the most tokens the bucket holds, i.e. the largest burst allowed
+        @param refill_rate: tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Take a token, waiting for one to be added if the bucket is empty.
+        @return: None
+        """
+        self.refill()
+        if self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+            self.refill()
+
+        self.tokens -= 1
+
+    def drain(self):
+        """Empty the bucket, e.g. after being rate limited anyway.
+        @return: None
+        """
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+class OutboundQueue:
+    def __init__(self, burst: int = 5, refill_rate: float = 1.0, max_retries: int = 3, backoff: float = 2.0):
+        """Initialize the outbound queue.
+        The default bucket allows a burst of 5 messages then 1 per second per channel, which is Discord's per-channel send limit.
+        @param burst: messages a channel may be sent back to back
+        @param refill_rate: messages per second a channel may be sent after a burst
+        @param max_retries: the number of times a rate limited message is retried
+        @param backoff: seconds to wait before the first retry; doubled for each retry after that
+        """
+        self.burst = burst
+        self.refill_rate = refill_rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # queues is dict of { channel_id : (channel, deque of (embed, attachment)) }
+        self.queues = dict()
+        # buckets is dict of { channel_id : TokenBucket }, kept across flushes
+        self.buckets = dict()
+
+    def enqueue(self, channel: discord.abc.Messageable, embed: discord.Embed, attachment: tuple[str, bytes] = None):
+        """Queue an embed to be sent to a channel on the next flush.
+        @param channel: the channel to send the embed to
+        @param embed: the embed
+        @param attachment: (filename, contents) of the file the embed refers to, if any. Each file is attached once per message
+        @return: None
+        """
+        _, queue = self.queues.setdefault(channel.id, (channel, deque()))
+        queue.append((embed, attachment))
+
+    async def flush(self):
+        """Send every queued embed, with each channel's messages sent in order and different channels sent concurrently.
+        @return: None
+        """
+        queues = self.queues
+        self.queues = dict()
+        if len(queues) == 0:
+            return
+
+        depths = [len(queue) for _, queue in queues.values()]
+        logger.info(f'Sending {sum(depths)} queued updates to {len(queues)} channels (deepest queue: {max(depths)})')
+
+        start_time = time.perf_counter()
+        latencies = await asyncio.gather(*[self.drain_channel(channel, queue) for channel, queue in queues.values()])
+        latencies = [latency for channel_latencies in latencies for latency in channel_latencies]
+
+        if len(latencies) > 0:
+            logger.info(f'Sent {len(latencies)} messages in {time.perf_counter() - start_time:.2f}s '
+                        f'(send latency avg {sum(latencies) / len(latencies) * 1000:.0f}ms, max {max(latencies) * 1000:.0f}ms)')
+
+    async def drain_channel(self, channel: discord.abc.Messageable, queue: deque) -> list[float]:
+        """Send a channel's queued embeds, packed into as few messages as possible.
+        @param channel: the channel
+        @param queue: the channel's queued (embed, attachment) tuples
+        @return: the latency of each message sent, in seconds
+        """
+        bucket = self.buckets.setdefault(channel.id, TokenBucket(self.burst, self.refill_rate))
+        latencies = []
+
+        while len(queue) > 0:
+            embeds, attachments = next_message(queue)
+
+            try:
+                latency = await self.send(channel, bucket, embeds, attachments)
+            except discord.Forbidden:
+                logger.warning(f'Missing permissions to send to channel {channel.id}, dropping {len(queue) + len(embeds)} updates')
+                return latencies
+            except discord.HTTPException as e:
+                logger.error(f'Failed to send {len(embeds)} updates to channel {channel.id}: {e}')
+                continue
+
+            if latency is not None:
+                latencies.append(latency)
+                logger.debug(f'Sent {len(embeds)} updates to channel {channel.id} in {latency * 1000:.0f}ms ({len(queue)} queued)')
+
+        return latencies
+
+    async def send(self, channel: discord.abc.Messageable, bucket: TokenBucket, embeds: list[discord.Embed], attachments: dict[str, bytes]) -> float:
+        """Send a message, retrying with exponential backoff if it is rate limited.
+        @param channel: the channel
+        @param bucket: the channel's token bucket
+        @param embeds: the message's embeds
+        @param attachments: dict of { filename : contents } of the message's attachments
+        @return: the send latency in seconds, or None if the message was still rate limited after every retry
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            await bucket.acquire()
+
+            # files are consumed once sent, so each attempt wraps the contents afresh
+            files = [discord.File(io.BytesIO(contents), filename=filename) for filename, contents in attachments.items()]
+
+            start_time = time.perf_counter()
+            try:
+                await channel.send(embeds=embeds, files=files)
+                return time.perf_counter() - start_time
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+
+                bucket.drain()
+                logger.warning(f'Rate limited sending to channel {channel.id} (attempt {attempt + 1})')
+
+        logger.error(f'Giving up on {len(embeds)} updates to channel {channel.id} after {self.max_retries + 1} attempts')
+        return None
+
+def next_message(queue: deque) -> tuple[list[discord.Embed], dict[str, bytes]]:
+    """Take as many embeds off a queue as fit in one message.
+    @param queue: deque of (embed, attachment) tuples
+    @return: (the message's embeds, dict of { filename : contents } of the message's attachments)
+    """
+    embeds = []
+    attachments = dict()
+    chars = 0
+
+    while len(queue) > 0 and len(embeds) < MAX_EMBEDS_PER_MESSAGE:
+        embed, attachment = queue[0]
+        if len(embeds) > 0 and chars + len(embed) > MAX_EMBED_CHARS_PER_MESSAGE:
+            break
+
+        queue.popleft()
+        embeds.append(embed)
+        chars += len(embed)
+
+        if attachment is not None:
+            filename, contents = attachment
+            attachments[filename] = contents
+
+    return embeds, attachments
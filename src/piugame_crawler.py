@@ -1,9 +1,155 @@
 # piugame_crawler.py
 # Utility functions for crawling piugame.com leaderboards.
 
+import logging
+import os
 import re
+from collections import namedtuple
+
+logger = logging.getLogger('discord')
+
+# a single parsed leaderboard row; title is None for chart leaderboards
+RankingRow = namedtuple('RankingRow', ['rank', 'player_id', 'score', 'avatar_id', 'date', 'title'])
+
+MEDAL_RANKS = {
+    'goldmedal': 1,
+    'silvermedal': 2,
+    'bronzemedal': 3,
+}
+
+AVATAR_REGEX = re.compile(r'(?<=background-image:url\(\'https://phoenix\.piugame\.com/data/avatar_img/)[0-9a-z]+(?=\.png)')
+PUMBILITY_AVATAR_REGEX = re.compile(r'(?<=background-image:url\(\'https://piugame\.com/data/avatar_img/)[0-9a-z]+(?=\.png)')
+
+# the divs whose descendants hold a row's rank, score, date and avatar
+ROW_SECTIONS = {
+    'num': 'rank',
+    'score': 'score',
+    'date': 'date',
+    'profile_img': 'avatar',
+}
 
 class PIUGAME_CRAWLER:
+    # 'compiled' parses each row in a single pass, 'legacy' uses the per-field helpers,
+    # and 'verify' runs both, logs any differences and returns the legacy result
+    parser_mode = os.getenv('PIUGAME_PARSER', 'compiled').lower()
+
+    @staticmethod
+    def parse_row(ranking, pumbility: bool) -> RankingRow:
+        """Parse a leaderboard row with the configured parser.
+        @param ranking: the ranking li
+        @param pumbility: whether the ranking is for pumbility
+        @return: the parsed row
+        """
+        if PIUGAME_CRAWLER.parser_mode == 'legacy':
+            return PIUGAME_CRAWLER.parse_row_legacy(ranking, pumbility)
+
+        row = PIUGAME_CRAWLER.parse_row_compiled(ranking, pumbility)
+
+        if PIUGAME_CRAWLER.parser_mode == 'verify':
+            legacy_row = PIUGAME_CRAWLER.parse_row_legacy(ranking, pumbility)
+            if row != legacy_row:
+                logger.warning(f'Compiled parser returned {row}, but legacy parser returned {legacy_row}')
+            return legacy_row
+
+        return row
+
+    @staticmethod
+    def parse_row_legacy(ranking, pumbility: bool) -> RankingRow:
+        """Parse a leaderboard row by running each field's helper on it.
+        @param ranking: the ranking li
+        @param pumbility: whether the ranking is for pumbility
+        @return: the parsed row
+        """
+        ranking_info = ranking if pumbility else ranking.xpath('.//div[@class="in flex vc wrap"]')
+
+        return RankingRow(
+            rank=PIUGAME_CRAWLER.parse_rank(ranking_info),
+            player_id=PIUGAME_CRAWLER.parse_player_id(ranking_info, pumbility=pumbility),
+            score=PIUGAME_CRAWLER.parse_score(ranking_info),
+            avatar_id=PIUGAME_CRAWLER.parse_avatar_id(ranking_info, pumbility=pumbility),
+            date=PIUGAME_CRAWLER.parse_date(ranking),
+            title=PIUGAME_CRAWLER.parse_title(ranking_info) if pumbility else None,
+        )
+
+    @staticmethod
+    def parse_row_compiled(ranking, pumbility: bool) -> RankingRow:
+        """Parse a leaderboard row in a single walk over its elements.
+        @param ranking: the ranking li, as a selector or an lxml element
+        @param pumbility: whether the ranking is for pumbility
+        @return: the parsed row
+        """
+        root = ranking.root if hasattr(ranking, 'root') else ranking
+        name_class = 'profile_name en pl0' if pumbility else 'profile_name en'
+
+        # fields is dict of { field : first matching value }
+        fields = dict()
+        PIUGAME_CRAWLER.walk_row(root, None, name_class, fields)
+
+        rank = fields.get('rank')
+        if rank is not None:
+            try:
+                rank = int(rank)
+            except ValueError:
+                rank = 0
+        else:
+            medal_src = fields.get('medal', '')
+            rank = next((medal_rank for medal, medal_rank in MEDAL_RANKS.items() if medal in medal_src), 0)
+
+        score = fields.get('score')
+        score = int(score.replace(',', '')) if score is not None else 0
+
+        avatar_regex = PUMBILITY_AVATAR_REGEX if pumbility else AVATAR_REGEX
+        result = avatar_regex.search(fields.get('avatar', ''))
+
+        return RankingRow(
+            rank=rank,
+            player_id=f'{fields.get("name")}{fields.get("tag")}',
+            score=score,
+            avatar_id=result.group() if result is not None else '',
+            date=fields.get('date'),
+            title=fields.get('title') if pumbility else None,
+        )
+
+    @staticmethod
+    def walk_row(element, section: str, name_class: str, fields: dict):
+        """Collect a row's fields from an element's descendants, in document order.
+        @param element: the lxml element to walk
+        @param section: the row section the element is in, i.e. a value of ROW_SECTIONS, or None
+        @param name_class: the class of the player name div
+        @param fields: dict of { field : value } to fill in
+        @return: None
+        """
+        for child in element:
+            if not isinstance(child.tag, str):
+                # skip comments and processing instructions
+                continue
+
+            child_section = section
+            cls = child.get('class')
+
+            if child.tag == 'div':
+                if cls in ROW_SECTIONS:
+                    child_section = ROW_SECTIONS[cls]
+                elif cls == name_class:
+                    set_first(fields, 'name', first_text(child))
+                elif cls == 'profile_name st1 en':
+                    set_first(fields, 'tag', first_text(child))
+                elif cls == 're bgfix' and section == 'avatar':
+                    set_first(fields, 'avatar', child.get('style'))
+                elif cls is not None and 'profile_title en col' in cls:
+                    set_first(fields, 'title', first_text(child))
+            elif child.tag == 'i':
+                if section == 'rank' and cls == 'tt':
+                    set_first(fields, 'rank', first_text(child))
+                elif section == 'date' and cls == 'tt':
+                    set_first(fields, 'date', first_text(child))
+                elif section == 'score' and cls == 'tt en':
+                    set_first(fields, 'score', first_text(child))
+            elif child.tag == 'img' and section == 'rank':
+                set_first(fields, 'medal', child.get('src'))
+
+            PIUGAME_CRAWLER.walk_row(child, child_section, name_class, fields)
+
     @staticmethod
     def parse_rank(ranking_info) -> int:
         """Parse the player's rank.
@@ -92,3 +238,27 @@ class PIUGAME_CRAWLER:
         @return: the date the score was set
         """
         return ranking.xpath('.//div[@class="date"]//i[@class="tt"]/text()').get()
+
+def set_first(fields: dict, field: str, value: str):
+    """Set a field unless it has already been found; like XPath's get(), the first non-empty match wins.
+    @param fields: dict of { field : value }
+    @param field: the field to set
+    @param value: the matched value, or None if nothing matched
+    @return: None
+    """
+    if value is not None and field not in fields:
+        fields[field] = value
+
+def first_text(element) -> str:
+    """Get an element's first child text node, like the XPath text() step.
+    @param element: the lxml element
+    @return: the first text node, or None if the element has no text
+    """
+    if element.text is not None:
+        return element.text
+
+    for child in element:
+        if child.tail is not None:
+            return child.tail
+
+    return None
@@ -0,0 +1,104 @@
+# player_index.py
+
+from typing import Callable, Iterable, List
+
+from score import Score
+from util import intern_str
+
+class PlayerIndex:
+    def __init__(self, load_chart: Callable[[str], dict] = None):
+        """Initialize the index of every player's scores across all charts.
+        @param load_chart: gets a chart's dict of { player_id : Score } by its ID, for charts added with add_chart_players
+        """
+        self.load_chart = load_chart
+
+        # scores_by_player is dict of { player_id : dict of { chart_id : Score, or None until the chart is loaded } }
+        self.scores_by_player = dict()
+        # players_by_name is dict of { name : set of player_ids }
+        self.players_by_name = dict()
+
+    def update_chart(self, chart_id: str, prev_scores: dict[str, Score], scores: dict[str, Score]):
+        """Replace a chart's entries in the index.
+        @param chart_id: the chart's ID, lowercase
+        @param prev_scores: dict of { player_id : Score } previously indexed for the chart, or None
+        @param scores: dict of { player_id : Score } now on the chart
+        @return: None
+        """
+        if prev_scores is not None:
+            for player_id in prev_scores.keys() - scores.keys():
+                self.remove(player_id, chart_id)
+
+        for player_id, score in scores.items():
+            if player_id not in self.scores_by_player:
+                self.scores_by_player[player_id] = dict()
+                self.players_by_name.setdefault(player_id.split('#')[0], set()).add(player_id)
+
+            self.scores_by_player[player_id][chart_id] = score
+
+    def add_chart_players(self, chart_id: str, player_ids: Iterable[str]):
+        """Index the players on a chart whose scores have not been loaded yet. Their scores are loaded with load_chart when found.
+        @param chart_id: the chart's ID, lowercase
+        @param player_ids: the IDs of the players on the chart
+        @return: None
+        """
+        for player_id in player_ids:
+            if player_id not in self.scores_by_player:
+                player_id = intern_str(player_id)
+                self.scores_by_player[player_id] = dict()
+                self.players_by_name.setdefault(intern_str(player_id.split('#')[0]), set()).add(player_id)
+
+            self.scores_by_player[player_id].setdefault(chart_id, None)
+
+    def remove(self, player_id: str, chart_id: str):
+        """Remove a player's entry for a chart.
+        @param player_id: the player's ID, in the format of name#tag
+        @param chart_id: the chart's ID, lowercase
+        @return: None
+        """
+        player_scores = self.scores_by_player.get(player_id)
+        if player_scores is None:
+            return
+
+        player_scores.pop(chart_id, None)
+
+        if len(player_scores) == 0:
+            del self.scores_by_player[player_id]
+
+            name = player_id.split('#')[0]
+            self.players_by_name[name].discard(player_id)
+            if len(self.players_by_name[name]) == 0:
+                del self.players_by_name[name]
+
+    def find(self, player_id: str) -> List[tuple[str, Score]]:
+        """Find all chart entries for a player, loading the charts they are on if needed.
+        @param player_id: the player ID, in the format of name[#tag]; If [#tag] is not specified, all players with the same name are matched
+        @return: list of (chart_id, Score) tuples
+        """
+        entries = []
+        for matching_id in self.find_player_ids(player_id):
+            # copy first, since the crawler may update the index from its own thread
+            for chart_id, score in dict(self.scores_by_player.get(matching_id, {})).items():
+                if score is None:
+                    chart_scores = self.load_chart(chart_id)
+                    score = chart_scores.get(matching_id) if chart_scores is not None else None
+                    if score is None:
+                        continue
+
+                entries.append((chart_id, score))
+
+        return entries
+
+    def find_charts(self, player_id: str) -> List[str]:
+        """Find the charts a player is on, without loading them.
+        @param player_id: the player ID, in the format of name[#tag]; If [#tag] is not specified, all players with the same name are matched
+        @return: list of chart_ids
+        """
+        chart_ids = []
+        for matching_id in self.find_player_ids(player_id):
+            chart_ids.extend(list(self.scores_by_player.get(matching_id, {})))
+
+        return chart_ids
+
+    def find_player_ids(self, player_id: str) -> List[str]:
+        player_id = player_id.upper()
+        return [player_id] if '#' in player_id else list(self.players_by_name.get(player_id, ()))
@@ -0,0 +1,88 @@
+# prefix_trie.py
+# Case-insensitive prefix trie, so that completions are found by walking the typed prefix rather than scanning every entry.
+
+from typing import List
+
+class TrieNode:
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        # children is dict of { character : TrieNode }
+        self.children = dict()
+        # values is set of the values inserted under the key ending at this node, or None
+        self.values = None
+
+class PrefixTrie:
+    def __init__(self):
+        """Initialize an empty prefix trie."""
+        self.root = TrieNode()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, key: str, value: str = None):
+        """Insert a value under a key. A key may hold several values, and a value may be inserted under several keys.
+        @param key: the key, matched case-insensitively
+        @param value: the value to complete to; defaults to the key
+        @return: None
+        """
+        node = self.root
+        for char in key.lower():
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = TrieNode()
+            node = child
+
+        if node.values is None:
+            node.values = set()
+        if value is None:
+            value = key
+        if value not in node.values:
+            node.values.add(value)
+            self.size += 1
+
+    def insert_words(self, key: str, value: str = None):
+        """Insert a value under a key and under each word of the key onwards, so that it is also completed from the middle of the key.
+        @param key: the key, e.g. "Ghroth - SHORT CUT - D24"
+        @param value: the value to complete to; defaults to the key
+        @return: None
+        """
+        if value is None:
+            value = key
+
+        words = key.split()
+        for i in range(len(words)):
+            self.insert(' '.join(words[i:]), value)
+
+    def clear(self):
+        self.root = TrieNode()
+        self.size = 0
+
+    def complete(self, prefix: str, limit: int = 25) -> List[str]:
+        """Get the values whose keys start with a prefix.
+        Only the prefix's subtree is walked, and the walk stops as soon as enough values are found.
+        @param prefix: the prefix, matched case-insensitively
+        @param limit: the maximum number of values
+        @return: list of values, in alphabetical order of their keys
+        """
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        # walk the subtree depth-first in alphabetical order, so that only about limit paths below the prefix are visited
+        completions = dict()
+        stack = [node]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.values is not None:
+                for value in sorted(node.values):
+                    completions.setdefault(value, None)
+                    if len(completions) >= limit:
+                        return list(completions)
+
+            stack.extend(child for _, child in sorted(node.children.items(), reverse=True))
+
+        return list(completions)
@@ -1,21 +1,43 @@
 # pumbility.py
 
 import discord
+import functools
 
 from emojis import AVATAR_EMOJIS, RANKING_EMOJIS
-from util import get_rank_suffix
+from util import get_rank_suffix, intern_str
 
 PUMBILITY_LEADERBOARD_URL = 'https://piugame.com/leaderboard/pumbility_ranking.php'
 
+@functools.lru_cache(maxsize=16384)
+def render_description(pumbility: int, rank: int, tie_count: int, prev_pumbility: int, prev_rank: int, compare: bool) -> str:
+    rank_emoji = f'{RANKING_EMOJIS[rank]} ' if rank in RANKING_EMOJIS else '<:graymedal:1196960956517982359> '
+
+    rank_suffix = get_rank_suffix(rank)
+    tied_text = f' ({tie_count}-way tie)' if tie_count > 1 else ''
+    formatted_pumbility = format(pumbility, ',')
+
+    if prev_pumbility is None:
+        new_rank_text = ' (new)' if compare else ''
+        return f'Rank: {rank_emoji}*{rank}{rank_suffix}*{new_rank_text}{tied_text}\n' \
+               f'Pumbility: *{formatted_pumbility}*'
+    else:
+        prev_rank_suffix = get_rank_suffix(prev_rank)
+        prev_formatted_pumbility = format(prev_pumbility, ',')
+
+        return f'Rank: {rank_emoji}*{prev_rank}{prev_rank_suffix}* -> *{rank}{rank_suffix}*{tied_text}\n' \
+               f'Pumbility: *{prev_formatted_pumbility}* -> *{formatted_pumbility}*'
+
 class Pumbility():
+    __slots__ = ('player_id', 'pumbility', 'rank', 'tie_count', 'title', 'avatar_id', 'date')
+
     def __init__(self, player_id: str, pumbility: int, rank: int, tie_count: int, title: str, avatar_id: str, date: str):
-        self.player_id = player_id
+        self.player_id = intern_str(player_id)
         self.pumbility = pumbility
         self.rank = rank
         self.tie_count = tie_count
-        self.title = title
-        self.avatar_id = avatar_id
-        self.date = date
+        self.title = intern_str(title)
+        self.avatar_id = intern_str(avatar_id)
+        self.date = intern_str(date)
 
     async def embed(self, prev_pumbility: 'Pumbility', compare: bool) -> discord.Embed:
         embed_color = discord.Color.blue()
@@ -33,22 +55,10 @@ class Pumbility():
         return embed
 
     async def embed_description(self, prev_pumbility: 'Pumbility', compare: bool) -> str:
-        rank_emoji = f'{RANKING_EMOJIS[self.rank]} ' if self.rank in RANKING_EMOJIS else '<:graymedal:1196960956517982359> '
-
-        rank_suffix = get_rank_suffix(self.rank)
-        tied_text = f' ({self.tie_count}-way tie)' if self.tie_count > 1 else ''
-        formatted_pumbility = format(self.pumbility, ',')
-
         if prev_pumbility is None:
-            new_rank_text = ' (new)' if compare else ''
-            return f'Rank: {rank_emoji}*{self.rank}{rank_suffix}*{new_rank_text}{tied_text}\n' \
-                   f'Pumbility: *{formatted_pumbility}*'
+            return render_description(self.pumbility, self.rank, self.tie_count, None, None, compare)
         else:
-            prev_rank_suffix = get_rank_suffix(prev_pumbility.rank)
-            prev_formatted_pumbility = format(prev_pumbility.pumbility, ',')
-
-            return f'Rank: {rank_emoji}*{prev_pumbility.rank}{prev_rank_suffix}* -> *{self.rank}{rank_suffix}*{tied_text}\n' \
-                   f'Pumbility: *{prev_formatted_pumbility}* -> *{formatted_pumbility}*'
+            return render_description(self.pumbility, self.rank, self.tie_count, prev_pumbility.pumbility, prev_pumbility.rank, compare)
 
     def to_dict(self) -> dict:
         return {
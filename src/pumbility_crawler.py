@@ -7,15 +7,16 @@ import scrapy
 
 from piugame_crawler import PIUGAME_CRAWLER
 from pumbility import Pumbility, PUMBILITY_LEADERBOARD_URL
+from ranking_dict import RankingDict
 from util import update_curr_tie_count, update_next_tie_count
 
 class PumbilityCrawler(scrapy.Spider):
     name = 'pumbility_spider'
     start_urls = [PUMBILITY_LEADERBOARD_URL]
 
-    def __init__(self, pumbility_ranking: dict[str, Pumbility], pumbility_updates: List[tuple[Pumbility, Pumbility]]):
+    def __init__(self, pumbility_ranking: RankingDict, pumbility_updates: List[tuple[Pumbility, Pumbility]]):
         """Initialize the pumbility crawler.
-        @param pumbility_ranking: list of Pumbility objects
+        @param pumbility_ranking: RankingDict of { player_id : Pumbility }
         @param pumbility_updates: list of tuples of Pumbility objects
         @return: None
         """
@@ -33,12 +34,7 @@ class PumbilityCrawler(scrapy.Spider):
         pumbility_ranking = dict()
 
         for i, ranking in enumerate(ranking_list):
-            player_id = PIUGAME_CRAWLER.parse_player_id(ranking, pumbility=True)
-            pumbility = PIUGAME_CRAWLER.parse_score(ranking)
-            rank = PIUGAME_CRAWLER.parse_rank(ranking)
-            title = PIUGAME_CRAWLER.parse_title(ranking)
-            avatar_id = PIUGAME_CRAWLER.parse_avatar_id(ranking, pumbility=True)
-            date = PIUGAME_CRAWLER.parse_date(ranking)
+            rank, player_id, pumbility, avatar_id, date, title = PIUGAME_CRAWLER.parse_row(ranking, pumbility=True)
 
             tie_count = update_curr_tie_count(tie_count, rank, previous_rank, player_id, previous_player_id, curr_tied_players)
             pumbility_ranking[player_id] = Pumbility(player_id=player_id, pumbility=pumbility, rank=rank, tie_count=tie_count, title=title, avatar_id=avatar_id, date=date)
@@ -53,6 +49,7 @@ class PumbilityCrawler(scrapy.Spider):
             else:
                 self.pumbility_updates.append((pumbility, None))
 
+        # replacing the ranking's contents rebuilds its player name index
         self.pumbility_ranking.clear()
 
         for player_id, pumbility in pumbility_ranking.items():
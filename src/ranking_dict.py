@@ -0,0 +1,117 @@
+# ranking_dict.py
+
+from bisect import bisect_left, bisect_right
+from typing import List
+
+from util import intern_str
+
+class RankingDict(dict):
+    """dict of { player_id : record } for a single ranking, indexed by the players' bare names and by rank.
+    Player IDs are in the format of name#tag, and records must have a rank attribute.
+    Only item assignment, deletion, pop and clear keep the indexes up to date.
+    """
+    def __init__(self, *a, **kw):
+        dict.__init__(self)
+        # players_by_name is dict of { name : player_id, or set of player_ids if several players share the name }
+        # most names have a single tag, so a lone player ID is stored as is rather than in a set of its own
+        self.players_by_name = dict()
+
+        # records sorted by rank, and their ranks; built on first use after the ranking changes
+        self.rank_order = None
+        self.ranks = None
+
+        # unix time the ranking was last crawled, or None if unknown
+        self.last_crawled = None
+        # digest of the ranking list on the last crawled page, and the page's ETag and Last-Modified headers
+        self.page_digest = None
+        self.etag = None
+        self.last_modified = None
+
+        for key, value in dict(*a, **kw).items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            # share the key with the record's own copy of the player ID
+            key = intern_str(key)
+            name = intern_str(key.split('#')[0])
+
+            player_ids = self.players_by_name.get(name)
+            if player_ids is None:
+                self.players_by_name[name] = key
+            elif isinstance(player_ids, str):
+                self.players_by_name[name] = set([player_ids, key])
+            else:
+                player_ids.add(key)
+        dict.__setitem__(self, key, value)
+        self.rank_order = None
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.unindex(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self.unindex(key)
+        return dict.pop(self, key, *default)
+
+    def clear(self):
+        dict.clear(self)
+        self.players_by_name.clear()
+        self.rank_order = None
+
+    def unindex(self, key):
+        name = key.split('#')[0]
+        player_ids = self.players_by_name[name]
+        if isinstance(player_ids, str):
+            del self.players_by_name[name]
+        else:
+            player_ids.discard(key)
+            if len(player_ids) == 1:
+                self.players_by_name[name] = next(iter(player_ids))
+
+        self.rank_order = None
+
+    def find(self, player_id: str) -> List:
+        """Find the records matching a player ID.
+        @param player_id: the player ID, in the format of name[#tag]; If [#tag] is not specified, all players with the same name are matched
+        @return: list of the matching records
+        """
+        player_id = player_id.upper()
+
+        if '#' in player_id:
+            return [self[player_id]] if player_id in self else []
+
+        player_ids = self.players_by_name.get(player_id, ())
+        if isinstance(player_ids, str):
+            return [self[player_ids]]
+
+        return [self[key] for key in player_ids]
+
+    def get_rank_order(self) -> List:
+        """Get the records sorted by rank. Tied records keep their order on the leaderboard.
+        @return: list of the records, sorted by rank
+        """
+        if self.rank_order is None:
+            self.rank_order = sorted(self.values(), key=lambda record: record.rank)
+            self.ranks = [record.rank for record in self.rank_order]
+
+        return self.rank_order
+
+    def find_rank_range(self, lo: int, hi: int) -> List:
+        """Find the records placed from the lo-th to the hi-th position, along with every record tied with them.
+        @param lo: the first position, starting at 1
+        @param hi: the last position, inclusive
+        @return: list of the matching records, sorted by rank
+        """
+        rank_order = self.get_rank_order()
+        if lo > len(rank_order):
+            return []
+
+        hi = min(hi, len(rank_order))
+
+        # a tied group shares the rank of its first position, so widen the range to cover whole groups
+        start = bisect_left(self.ranks, self.ranks[lo - 1])
+        end = bisect_right(self.ranks, self.ranks[hi - 1])
+
+        return rank_order[start:end]
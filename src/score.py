@@ -1,11 +1,14 @@
 # score.py
 
 import discord
+import functools
+import io
 import os
+from typing import NamedTuple
 
 from chart import Chart
 from emojis import AVATAR_EMOJIS, GRADE_EMOJIS, RANKING_EMOJIS
-from util import get_rank_suffix
+from util import get_rank_suffix, intern_str
 
 MODE_COLORS = {
     'Single': discord.Color.red(),
@@ -19,57 +22,108 @@ MODE_ICON_URLS = {
     'Co-op' : os.path.join(os.path.dirname(os.path.dirname(__file__)), 'assets', 'c_bg.png'),
 }
 
+class ChartHeader(NamedTuple):
+    author: str
+    url: str
+    icon_filename: str
+    icon_url: str
+    thumbnail_url: str
+    color: discord.Color
+
+@functools.lru_cache(maxsize=None)
+def read_icon(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+# the parts of a score's embed that are the same for every score on a chart
+@functools.lru_cache(maxsize=8192)
+def get_chart_header(chart: Chart) -> ChartHeader:
+    icon_path = MODE_ICON_URLS.get(chart.mode)
+    icon_filename = os.path.basename(icon_path) if icon_path is not None else None
+
+    return ChartHeader(
+        author=chart.chart_id,
+        url=chart.get_leaderboard_url(),
+        icon_filename=icon_filename,
+        icon_url=f'attachment://{icon_filename}' if icon_filename is not None else None,
+        thumbnail_url=chart.thumbnail_url,
+        color=MODE_COLORS[chart.mode] if chart.mode in MODE_COLORS else discord.Color.black(),
+    )
+
+@functools.lru_cache(maxsize=16384)
+def render_description(score: int, rank: int, tie_count: int, prev_score: int, prev_rank: int, compare: bool) -> str:
+    grade = Score.calculate_grade(score)
+    rank_emoji = f'{RANKING_EMOJIS[rank]} ' if rank in RANKING_EMOJIS else '<:graymedal:1196960956517982359> '
+    grade_emoji = f'{GRADE_EMOJIS[grade]} ' if grade in GRADE_EMOJIS else ''
+
+    rank_suffix = get_rank_suffix(rank)
+    tied_text = f' ({tie_count}-way tie)' if tie_count > 1 else ''
+    formatted_score = format(score, ',')
+
+    if prev_score is None:
+        new_rank_text = ' (new)' if compare else ''
+        return f'{rank_emoji}*{rank}{rank_suffix}*{new_rank_text}{tied_text}\n' \
+               f'{grade_emoji}*{formatted_score}*'
+    else:
+        prev_rank_suffix = get_rank_suffix(prev_rank)
+        prev_formatted_score = format(prev_score, ',')
+
+        return f'{rank_emoji}*{prev_rank}{prev_rank_suffix}* -> *{rank}{rank_suffix}*{tied_text}\n' \
+               f'{grade_emoji}*{prev_formatted_score}* -> *{formatted_score}*'
+
 class Score():
+    # there are ~100 scores per chart across every chart, so scores are slotted and share their repeated strings
+    __slots__ = ('chart', 'player', 'score', 'rank', 'tie_count', 'avatar_id', 'date')
+
     def __init__(self, chart: Chart, player: str, score: int, rank: int, tie_count: int, avatar_id: str, date: str):
         self.chart = chart
-        self.player = player
+        self.player = intern_str(player)
         self.score = score
-        self.grade = Score.calculate_grade(score)
         self.rank = rank
         self.tie_count = tie_count
-        self.avatar_id = avatar_id
-        self.date = date
+        self.avatar_id = intern_str(avatar_id)
+        self.date = intern_str(date)
+
+    @property
+    def grade(self) -> str:
+        return Score.calculate_grade(self.score)
+
+    async def embed(self, prev_score: 'Score', compare: bool) -> tuple[discord.Embed, discord.File]:
+        icon = self.get_icon()
+        f = discord.File(io.BytesIO(icon[1]), filename=icon[0]) if icon is not None else None
+
+        return await self.make_embed(prev_score, compare), f
 
-    async def embed(self, prev_score: 'Score', compare: bool) -> discord.Embed:
-        embed_color = MODE_COLORS[self.chart.mode] if self.chart.mode in MODE_COLORS else discord.Color.black()
+    # the embed refers to the mode icon by filename, without attaching it
+    async def make_embed(self, prev_score: 'Score', compare: bool) -> discord.Embed:
+        header = get_chart_header(self.chart)
         avatar_emoji = f'{AVATAR_EMOJIS[self.avatar_id]} ' if self.avatar_id in AVATAR_EMOJIS else ''
 
         embed =  discord.Embed(
             title=f'{avatar_emoji}{self.player}',
             description=await self.embed_description(prev_score, compare),
-            color=embed_color,
+            color=header.color,
         )
 
-        icon_url = None
-        f = None
-        if self.chart.mode in MODE_ICON_URLS:
-            f = discord.File(MODE_ICON_URLS[self.chart.mode], filename='image.png')
-            icon_url = 'attachment://image.png'
-
-        embed.set_author(name=self.chart.chart_id, url=self.chart.get_leaderboard_url(), icon_url=icon_url)
-        embed.set_thumbnail(url=self.chart.thumbnail_url)
+        embed.set_author(name=header.author, url=header.url, icon_url=header.icon_url)
+        embed.set_thumbnail(url=header.thumbnail_url)
         embed.set_footer(text=f'Date • {self.date}')
 
-        return embed, f
+        return embed
 
-    async def embed_description(self, prev_score: 'Score', compare: bool) -> str:
-        rank_emoji = f'{RANKING_EMOJIS[self.rank]} ' if self.rank in RANKING_EMOJIS else '<:graymedal:1196960956517982359> '
-        grade_emoji = f'{GRADE_EMOJIS[self.grade]} ' if self.grade in GRADE_EMOJIS else ''
+    # each mode icon is attached under its own filename, so that embeds of different modes can share a message
+    def get_icon(self) -> tuple[str, bytes]:
+        header = get_chart_header(self.chart)
+        if header.icon_filename is None:
+            return None
 
-        rank_suffix = get_rank_suffix(self.rank)
-        tied_text = f' ({self.tie_count}-way tie)' if self.tie_count > 1 else ''
-        formatted_score = format(self.score, ',')
+        return header.icon_filename, read_icon(MODE_ICON_URLS[self.chart.mode])
 
+    async def embed_description(self, prev_score: 'Score', compare: bool) -> str:
         if prev_score is None:
-            new_rank_text = ' (new)' if compare else ''
-            return f'{rank_emoji}*{self.rank}{rank_suffix}*{new_rank_text}{tied_text}\n' \
-                   f'{grade_emoji}*{formatted_score}*'
+            return render_description(self.score, self.rank, self.tie_count, None, None, compare)
         else:
-            prev_rank_suffix = get_rank_suffix(prev_score.rank)
-            prev_formatted_score = format(prev_score.score, ',')
-
-            return f'{rank_emoji}*{prev_score.rank}{prev_rank_suffix}* -> *{self.rank}{rank_suffix}*{tied_text}\n' \
-                   f'{grade_emoji}*{prev_formatted_score}* -> *{formatted_score}*'
+            return render_description(self.score, self.rank, self.tie_count, prev_score.score, prev_score.rank, compare)
 
     def to_dict(self) -> dict:
         return {
@@ -0,0 +1,258 @@
+# score_history.py
+# Append-only log of every score and Pumbility change, indexed by chart and by player so that a query only reads its own records.
+#
+# Each record is a fixed header followed by its key and player ID in UTF-8:
+#   timestamp (float64), value (uint32), rank (uint16), key length (uint16), player ID length (uint16)
+# The key is the chart's ID, or PUMBILITY_KEY for Pumbility changes.
+
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Iterable, List, NamedTuple
+
+from util import write_atomic
+
+logger = logging.getLogger('discord')
+
+RECORD_HEADER = struct.Struct('<dIHHH')
+
+# the key of Pumbility records, which cannot collide with a chart ID
+PUMBILITY_KEY = '#pumbility'
+
+class HistoryRecord(NamedTuple):
+    key: str
+    player_id: str
+    timestamp: float
+    value: int
+    rank: int
+
+def encode_record(record: HistoryRecord) -> bytes:
+    key = record.key.encode('utf-8')
+    player_id = record.player_id.encode('utf-8')
+    return RECORD_HEADER.pack(record.timestamp, record.value, record.rank, len(key), len(player_id)) + key + player_id
+
+def decode_records(data: bytes, base_offset: int = 0) -> Iterable[tuple[int, int, HistoryRecord]]:
+    """Decode consecutive records. A truncated record at the end, e.g. from a crash mid-append, is ignored.
+    @param data: the encoded records
+    @param base_offset: the offset of data in the log
+    @return: iterable of (offset in the log, offset of the next record in the log, HistoryRecord)
+    """
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, value, rank, key_len, player_len = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + key_len + player_len
+        if end > len(data):
+            return
+
+        key_start = offset + RECORD_HEADER.size
+        key = data[key_start:key_start + key_len].decode('utf-8')
+        player_id = data[key_start + key_len:end].decode('utf-8')
+        yield base_offset + offset, base_offset + end, HistoryRecord(key, player_id, timestamp, value, rank)
+
+        offset = end
+
+class ScoreHistory:
+    def __init__(self, log_file: str, index_file: str, compact_threshold: int = 50000):
+        """Initialize the score history. It is empty until loaded.
+        @param log_file: the append-only log of records
+        @param index_file: the saved index of the log, so that only records appended since are read at startup
+        @param compact_threshold: the number of records appended since the last compaction above which the log is compacted
+        """
+        self.log_file = log_file
+        self.index_file = index_file
+        self.compact_threshold = compact_threshold
+
+        # offsets is dict of { key : dict of { player_id : list of record offsets in the log, oldest first } }
+        self.offsets = dict()
+        # keys_by_player is dict of { player_id : set of keys }
+        self.keys_by_player = dict()
+        # players_by_name is dict of { name : set of player_ids }
+        self.players_by_name = dict()
+
+        self.log_size = 0
+        self.appended_since_compact = 0
+
+        # appends and compactions run in worker threads
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load the saved index, and index the records appended to the log after it was saved.
+        @return: None
+        """
+        if not os.path.isfile(self.log_file):
+            return
+
+        log_size = os.path.getsize(self.log_file)
+        indexed_size = 0
+
+        if os.path.isfile(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                # compaction replaces the log, so an index saved before the log was last replaced no longer applies
+                if index['log_inode'] == os.stat(self.log_file).st_ino and index['log_size'] <= log_size:
+                    for key, player_id, offsets in index['entries']:
+                        self.add_offsets(key, player_id, offsets)
+                    indexed_size = index['log_size']
+                    self.appended_since_compact = index['appended_since_compact']
+            except (OSError, ValueError, KeyError):
+                logger.exception(f'Failed to load {self.index_file}, reindexing {self.log_file}')
+
+        if indexed_size == 0:
+            self.clear_index()
+
+        with open(self.log_file, 'rb') as f:
+            f.seek(indexed_size)
+            tail = f.read()
+
+        end = indexed_size
+        for offset, end, record in decode_records(tail, indexed_size):
+            self.add_offsets(record.key, record.player_id, [offset])
+            self.appended_since_compact += 1
+
+        self.log_size = end
+        if end < log_size:
+            # drop the partial record left by an interrupted append, so that the next append starts on a record boundary
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(end)
+
+    def clear_index(self):
+        self.offsets = dict()
+        self.keys_by_player = dict()
+        self.players_by_name = dict()
+        self.appended_since_compact = 0
+
+    def add_offsets(self, key: str, player_id: str, offsets: List[int]):
+        player_offsets = self.offsets.setdefault(key, dict())
+        if player_id not in player_offsets:
+            player_offsets[player_id] = []
+            self.keys_by_player.setdefault(player_id, set()).add(key)
+            self.players_by_name.setdefault(player_id.split('#')[0], set()).add(player_id)
+
+        player_offsets[player_id].extend(offsets)
+
+    def append(self, records: List[HistoryRecord]):
+        """Append records to the log. Runs in a worker thread.
+        @param records: the records to append
+        @return: None
+        """
+        if len(records) == 0:
+            return
+
+        with self.lock:
+            encoded = [encode_record(record) for record in records]
+            with open(self.log_file, 'ab') as f:
+                f.write(b''.join(encoded))
+
+            offset = self.log_size
+            for record, data in zip(records, encoded):
+                self.add_offsets(record.key, record.player_id, [offset])
+                offset += len(data)
+
+            self.log_size = offset
+            self.appended_since_compact += len(records)
+
+    def find_player_ids(self, player_id: str) -> List[str]:
+        """Find the player IDs with history matching an exact ID, or every ID with a bare name.
+        @param player_id: the player's ID, in the format of name[#tag]
+        @return: list of player IDs
+        """
+        # player IDs are uppercase on the leaderboards
+        player_id = player_id.upper()
+
+        # held while reading, as appends and compactions update the index from worker threads
+        with self.lock:
+            if player_id in self.keys_by_player:
+                return [player_id]
+            if '#' not in player_id:
+                return sorted(self.players_by_name.get(player_id, ()))
+            return []
+
+    def get_history(self, key: str, player_id: str) -> List[HistoryRecord]:
+        """Get a player's records for a chart, or for Pumbility, reading only those records from the log. Runs in a worker thread.
+        @param key: the chart's ID, lowercase, or PUMBILITY_KEY
+        @param player_id: the player's ID, in the format of name#tag
+        @return: list of HistoryRecords, oldest first
+        """
+        records = []
+
+        # held while reading, so that a compaction cannot move the records
+        with self.lock:
+            offsets = self.offsets.get(key, dict()).get(player_id, ())
+            if len(offsets) == 0:
+                return records
+
+            with open(self.log_file, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    timestamp, value, rank, _, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                    # the key and player ID are known from the index, so they are skipped
+                    records.append(HistoryRecord(key, player_id, timestamp, value, rank))
+
+        return records
+
+    def should_compact(self) -> bool:
+        return self.appended_since_compact > self.compact_threshold
+
+    def compact(self):
+        """Rewrite the log grouped by chart and player, so that each player's history on a chart is contiguous,
+        dropping records that repeat the value before them. Runs in a worker thread.
+        @return: None
+        """
+        with self.lock:
+            if not os.path.isfile(self.log_file):
+                return
+
+            with open(self.log_file, 'rb') as f:
+                data = f.read(self.log_size)
+
+            # entries is dict of { (key, player_id) : list of HistoryRecords }
+            entries = dict()
+            for _, _, record in decode_records(data):
+                entries.setdefault((record.key, record.player_id), []).append(record)
+
+            num_records = 0
+            compacted = bytearray()
+            self.clear_index()
+            for (key, player_id), records in sorted(entries.items()):
+                records.sort(key=lambda record: record.timestamp)
+                offsets = []
+                prev_value = None
+                for record in records:
+                    if record.value == prev_value:
+                        continue
+                    prev_value = record.value
+
+                    offsets.append(len(compacted))
+                    compacted += encode_record(record)
+                    num_records += 1
+
+                self.add_offsets(key, player_id, offsets)
+
+            write_atomic(self.log_file, bytes(compacted))
+            self.log_size = len(compacted)
+            self.save_index()
+
+        logger.info(f'Compacted the score history from {len(data)} to {len(compacted)} bytes, {num_records} records')
+
+    def save_index(self):
+        """Save the index, so that the next load only reads records appended after now.
+        Must be called with the lock held, or when no appends can run.
+        @return: None
+        """
+        entries = [[key, player_id, offsets] for key, player_offsets in self.offsets.items() for player_id, offsets in player_offsets.items()]
+        write_atomic(self.index_file, json.dumps({
+            'log_inode': os.stat(self.log_file).st_ino if os.path.isfile(self.log_file) else None,
+            'log_size': self.log_size,
+            'appended_since_compact': self.appended_since_compact,
+            'entries': entries,
+        }))
+
+    def close(self):
+        """Save the index. Runs in a worker thread.
+        @return: None
+        """
+        with self.lock:
+            self.save_index()
@@ -0,0 +1,31 @@
+# single_flight.py
+
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+class SingleFlight:
+    def __init__(self):
+        """Initialize the single-flight group."""
+        # in_flight is dict of { key : asyncio.Task }
+        self.in_flight = dict()
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable], *args):
+        """Run a coroutine function for a key, unless one is already running for that key.
+        Concurrent callers with the same key all await the same run and receive its result.
+        @param key: the key identifying the work, e.g. a chart ID
+        @param func: the coroutine function to run
+        @param args: the arguments to call func with
+        @return: the result of the run
+        """
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(func(*args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done_task: self.forget(key, done_task))
+
+        # shield the shared run so that one caller being cancelled does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable, task: asyncio.Task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
@@ -1,17 +1,23 @@
 # songlist_crawler.py
-# Run this script to scrape the leaderboard songlist from the website and save it to a CSV file.
+# Crawls the leaderboard songlist. The bot refreshes it periodically; run this script to scrape it and save it to a CSV file by hand.
 
 import csv
+import io
 import os
 import re
+from typing import List
 
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
+from util import write_atomic
+
 BASE_URL = 'https://phoenix.piugame.com/leaderboard/over_ranking.php'
 START_URL = f'{BASE_URL}?&&page=1'
 OUTPUT_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'songlist.csv')
 
+SONGLIST_FIELDS = ['title', 'mode', 'level', 'id', 'thumbnail']
+
 MODE_PREFIX_DICT = {
     'c': 'Co-op',
     'd': 'Double',
@@ -22,28 +28,30 @@ class SonglistCrawler(scrapy.Spider):
     name = 'songlist_crawler'
     start_urls = [START_URL]
 
-    def __init__(self):
-        self.songlist = []
+    def __init__(self, songlist: List[dict] = None):
+        """Initialize the songlist crawler.
+        @param songlist: list of the charts found, as dicts of SONGLIST_FIELDS; filled in as pages are parsed
+        """
+        self.songlist = songlist if songlist is not None else []
 
     def parse(self, response):
-        ranking_list = response.xpath('//ul[@class="rating_ranking_list flex wrap overRangking_st"]/li')
-        for ranking in ranking_list:
-            self.parse_ranking(ranking)
+        self.parse_page(response)
 
-        page_buttons = response.xpath('.//div[@class="board_paging"]/button')
-        follow_next = False
-        for button in page_buttons:
-            if follow_next:
-                next_url_suffix = re.search(r'(?<=location\.href=\').+(?=\')', button.xpath('./@onclick').get()).group()
-                next_page_url = f'{BASE_URL}{next_url_suffix}'
-                yield response.follow(next_page_url, callback=self.parse)
-            else:
-                follow_next = button.xpath('./@class').get() == 'on'
+        # the paging buttons only show the next few pages, but the last button links to the last page,
+        # so every other page is requested at once from the first one
+        last_page = 1
+        for onclick in response.xpath('.//div[@class="board_paging"]/button/@onclick').getall():
+            page = re.search(r'page=([0-9]+)', onclick)
+            if page is not None:
+                last_page = max(last_page, int(page.group(1)))
 
-        # sort songlist by title
-        self.songlist = sorted(self.songlist, key=lambda x: x['title'])
+        for page in range(2, last_page + 1):
+            yield response.follow(f'{BASE_URL}?&&page={page}', callback=self.parse_page)
 
-        self.save()
+    def parse_page(self, response):
+        ranking_list = response.xpath('//ul[@class="rating_ranking_list flex wrap overRangking_st"]/li')
+        for ranking in ranking_list:
+            self.parse_ranking(ranking)
 
     def parse_ranking(self, ranking):
         leaderbord_url = ranking.xpath('.//a[@class="in flex vc wrap"]/@href').get()
@@ -77,16 +85,33 @@ class SonglistCrawler(scrapy.Spider):
             'thumbnail': thumbnail_url,
         })
 
-    def save(self):
-        with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['title', 'mode', 'level', 'id', 'thumbnail'])
-            writer.writeheader()
-            writer.writerows(self.songlist)
+def sort_songlist(songlist: List[dict]) -> List[dict]:
+    """Sort a crawled songlist by title, dropping charts listed twice, e.g. if the listing shifted while it was crawled.
+    @param songlist: list of charts, as dicts of SONGLIST_FIELDS
+    @return: the sorted list
+    """
+    unique_charts = { row['id']: row for row in songlist }
+    return sorted(unique_charts.values(), key=lambda x: (x['title'], x['mode'], x['level']))
+
+def serialize_songlist(songlist: List[dict]) -> str:
+    """Format a songlist as CSV.
+    @param songlist: list of charts, as dicts of SONGLIST_FIELDS
+    @return: the CSV text
+    """
+    f = io.StringIO(newline='')
+    writer = csv.DictWriter(f, fieldnames=SONGLIST_FIELDS)
+    writer.writeheader()
+    writer.writerows(songlist)
+    return f.getvalue()
 
 def main():
+    songlist = []
+
     process = CrawlerProcess()
-    process.crawl(SonglistCrawler)
+    process.crawl(SonglistCrawler, songlist=songlist)
     process.start()
 
+    write_atomic(OUTPUT_FILE, serialize_songlist(sort_songlist(songlist)))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,65 @@
+# subscription_index.py
+# Maps tracked players to the guilds tracking them, so that updates can be routed to guilds in one pass.
+
+from typing import Callable, Iterable, Set
+
+class SubscriptionIndex:
+    def __init__(self):
+        """Initialize the subscription index."""
+        # guilds_by_player is dict of { tracked player_id or bare name : set of guild_ids }
+        self.guilds_by_player = dict()
+
+    def subscribe(self, guild_id: int, player_id: str):
+        """Record that a guild tracks a player.
+        @param guild_id: the guild's ID
+        @param player_id: the tracked player's ID in the format of name#tag, or a bare name to track every tag, uppercase
+        @return: None
+        """
+        self.guilds_by_player.setdefault(player_id, set()).add(guild_id)
+
+    def unsubscribe(self, guild_id: int, player_id: str):
+        """Record that a guild no longer tracks a player.
+        @param guild_id: the guild's ID
+        @param player_id: the tracked player's ID or bare name, uppercase
+        @return: None
+        """
+        guild_ids = self.guilds_by_player.get(player_id)
+        if guild_ids is None:
+            return
+
+        guild_ids.discard(guild_id)
+        if len(guild_ids) == 0:
+            del self.guilds_by_player[player_id]
+
+    def find_guilds(self, player_id: str) -> Set[int]:
+        """Find the guilds tracking a player, either by their full ID or by their bare name.
+        @param player_id: the player's ID, in the format of name#tag
+        @return: set of guild_ids
+        """
+        guild_ids = self.guilds_by_player.get(player_id, set())
+
+        name = player_id.split('#')[0]
+        if name != player_id and name in self.guilds_by_player:
+            guild_ids = guild_ids | self.guilds_by_player[name]
+
+        return guild_ids
+
+    def get_tracked_players(self) -> Set[str]:
+        """Get every player tracked by any guild.
+        @return: set of tracked player_ids and bare names
+        """
+        return set(self.guilds_by_player.keys())
+
+    def route(self, updates: Iterable[tuple], get_player_id: Callable[[tuple], str]) -> dict[int, list]:
+        """Route updates to the guilds tracking their players.
+        @param updates: the updates, e.g. (new_score, prev_score) tuples
+        @param get_player_id: gets the ID of the player an update belongs to
+        @return: dict of { guild_id : list of updates }, with each guild's updates in their original order
+        """
+        guild_updates = dict()
+
+        for update in updates:
+            for guild_id in self.find_guilds(get_player_id(update)):
+                guild_updates.setdefault(guild_id, []).append(update)
+
+        return guild_updates
@@ -1,6 +1,9 @@
 # util.py
 
-from typing import List
+import os
+import sys
+import tempfile
+from typing import List, Union
 
 RANKING_SUFFIXES = {
     1 : 'st',
@@ -70,3 +73,27 @@ def update_next_tie_count(tie_count: int, rank: int, previous_rank: int, i: int,
         curr_tied_players.clear()
 
     return tie_count
+
+def intern_str(value: str) -> str:
+    """Intern a string, so that every copy of it shares one object.
+    @param value: the string, or None
+    @return: the interned string, or None
+    """
+    return sys.intern(value) if value is not None else None
+
+def write_atomic(path: str, text: Union[str, bytes]):
+    """Write text or binary data to a file atomically.
+    The data is written to a temporary file in the same directory, which then replaces the target file.
+    @param path: the file to write to
+    @param text: the text, or bytes, to write
+    @return: None
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with (os.fdopen(fd, 'wb') if isinstance(text, bytes) else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
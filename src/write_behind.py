@@ -0,0 +1,89 @@
+# write_behind.py
+# Write-behind persistence: snapshots are serialized and written in a worker thread, off the event loop.
+
+import asyncio
+import json
+import logging
+import os
+from typing import Callable
+
+from util import write_atomic
+
+logger = logging.getLogger('discord')
+
+class WriteBehindWriter:
+    def __init__(self, delay: float = 1.0):
+        """Initialize the writer.
+        @param delay: seconds to wait before writing, so that bursts of save requests are coalesced into one write
+        """
+        self.delay = delay
+
+        # pending is dict of { path : (snapshot, serialize) }
+        self.pending = dict()
+        # cancelled is set of the paths cancelled while a batch was being written
+        self.cancelled = set()
+        self.drain_task = None
+
+    def schedule(self, path: str, snapshot, serialize: Callable = None):
+        """Schedule a snapshot to be written to a file.
+        If a write to the same path is already pending, the newer snapshot replaces it.
+        Must be called from the event loop; the snapshot must not be mutated afterwards.
+        @param path: the file to write to
+        @param snapshot: the data to write
+        @param serialize: turns the snapshot into the text or bytes to write, in the worker thread; defaults to indented JSON
+        @return: None
+        """
+        self.pending[path] = (snapshot, serialize or serialize_json)
+
+        if self.drain_task is None or self.drain_task.done():
+            self.drain_task = asyncio.get_running_loop().create_task(self.drain())
+
+    async def drain(self):
+        """Write pending snapshots until there are none left.
+        @return: None
+        """
+        await asyncio.sleep(self.delay)
+
+        while len(self.pending) > 0:
+            batch = self.pending
+            self.pending = dict()
+            await asyncio.to_thread(self.write_batch, batch)
+            self.cancelled.clear()
+
+    def write_batch(self, batch: dict):
+        """Serialize and write a batch of snapshots. Runs in a worker thread.
+        @param batch: dict of { path : (snapshot, serialize) }
+        @return: None
+        """
+        for path, (snapshot, serialize) in batch.items():
+            if path in self.cancelled:
+                continue
+
+            try:
+                write_atomic(path, serialize(snapshot))
+                # cancelled mid-write, so the file the caller removed may have been written again
+                if path in self.cancelled:
+                    os.remove(path)
+            # a snapshot that fails to serialize must not stop the rest of the batch from being written
+            except Exception:
+                logger.exception(f'Failed to save {path}')
+
+    def cancel(self, path: str):
+        """Cancel the pending write to a file, e.g. before removing the file, so that it is not written again.
+        Must be called from the event loop.
+        @param path: the file
+        @return: None
+        """
+        self.pending.pop(path, None)
+        if self.drain_task is not None and not self.drain_task.done():
+            self.cancelled.add(path)
+
+    async def flush(self):
+        """Wait until all pending snapshots have been written.
+        @return: None
+        """
+        while self.drain_task is not None and not self.drain_task.done():
+            await asyncio.shield(self.drain_task)
+
+def serialize_json(snapshot) -> str:
+    return json.dumps(snapshot, indent=2)